@@ -1,15 +1,43 @@
-from flask import Flask, g, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory
-import sqlite3
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from flask import Flask, g, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, \
+    Response, stream_with_context, make_response
 import os
+import sys
 import secrets
-import bleach
+import sqlite3
+import threading
+import atexit
+import click
+import migrations
+import importer
+import sanitizer
+import exporters
+import http_cache
+import uploads
+import image_variants
+import search
+import audit
+import audit_archive
+import passwords
+import provisioning
+import facets
+import render
+import instrumentation
+import serving
+from functools import partial
+from db_pool import ConnectionPool
+from dashboard_query import Query, users_query, contents_query
+from pagination import keyset_page, offset_page
+from content_tags import sync_content_tags
+from fragment_cache import FragmentCache
+from principals import PrincipalCache
+from settings_store import SettingsStore
+from markupsafe import Markup
 from flask_wtf import CSRFProtect
 from flask_wtf.csrf import generate_csrf
 
 DB_PATH = 'data.db'
 UPLOAD_FOLDER = os.path.join('static', 'uploads')
+AUDIT_ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'audit_archive')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app = Flask(__name__)
@@ -35,87 +63,58 @@ def save_upload_file(file, max_size_bytes=4*1024*1024):
         return None
     if file.content_length and file.content_length > max_size_bytes:
         return None
-    # generate safe unique name using hash
-    import hashlib
-    ext = secure_filename(file.filename).rsplit('.', 1)[1] if '.' in secure_filename(file.filename) else 'tmp'
-    hash_name = hashlib.sha256(file.read()).hexdigest()[:16]
-    file.seek(0)
-    filename = f"{hash_name}.{ext}"
-    relpath = os.path.join('uploads', filename)
-    savepath = os.path.join('static', relpath)
-    file.save(savepath)
-    return '/static/' + relpath.replace('\\','/')
+    try:
+        row = uploads.store(get_db(), file, UPLOAD_FOLDER, max_size_bytes)
+    except uploads.UploadRejected:
+        return None
+    if row['width'] is None:
+        variant_queue.enqueue(row['sha256'])
+    return '/static/uploads/' + row['filename']
 
 
-@app.route('/admin/upload_image', methods=['POST'])
-@admin_required
-def admin_upload_image():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file'}), 400
-    file = request.files['file']
-    url = save_upload_file(file)
-    if url:
-        return jsonify({'location': url})
-    return jsonify({'error': 'Invalid file'}), 400
+# statements slower than this (ms) are logged with their query plan
+instrumentation.recorder.slow_ms = int(os.environ.get('SLOW_QUERY_MS', instrumentation.SLOW_MS))
+db_pool = ConnectionPool(DB_PATH, on_connect=search.register, factory=instrumentation.Connection)
+# rendered /user sidebar and content list per grade
+dashboard_cache = FragmentCache()
+principal_cache = PrincipalCache()
+settings = SettingsStore()
+password_pool = passwords.VerifyPool(workers=max(1, (os.cpu_count() or 2) // 2))
+login_limiter = passwords.RateLimiter()
+# one school behind NAT shares an address, so the per-address bucket is larger
+address_limiter = passwords.RateLimiter(rate=2.0, burst=60)
+audit_writer = audit.AuditWriter(db_pool.connection)
+atexit.register(audit_writer.close)
+# resized WebP variants of uploads; finishing one refreshes pages that show it
+render_job = render.RenderJob(db_pool.connection, lambda db: settings.get(db, 'sanitize_html'),
+                              on_batch=lambda db: bump_generation(db, 'contents'))
+
 
+def variants_ready(db, upload):
+    render.mark_stale(db, upload['filename'])
+    bump_generation(db, 'contents')
+    render_job.kick()
 
 
+variant_queue = image_variants.VariantQueue(db_pool.connection, UPLOAD_FOLDER, on_done=variants_ready)
+
 
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DB_PATH)
-        db.row_factory = sqlite3.Row
+        db = g._database = db_pool.connection()
     return db
 
 
 def init_db():
-    db = get_db()
-    cur = db.cursor()
-    cur.executescript('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        grade INTEGER DEFAULT 0,
-        is_admin INTEGER DEFAULT 0,
-        starred INTEGER DEFAULT 0
-    );
-    CREATE TABLE IF NOT EXISTS contents (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT,
-        html TEXT,
-        link TEXT,
-        categories TEXT,
-        grades TEXT,
-        author_id INTEGER,
-        FOREIGN KEY(author_id) REFERENCES users(id)
-    );
-    CREATE TABLE IF NOT EXISTS audit_logs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        ts DATETIME DEFAULT CURRENT_TIMESTAMP,
-        user_id INTEGER,
-        action TEXT
-    );
-    CREATE TABLE IF NOT EXISTS settings (
-        key TEXT PRIMARY KEY,
-        value TEXT
-    );
-    ''')
-    db.commit()
-    # try to add role column to users table (for upgrades)
-    try:
-        db.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'user'")
-        db.commit()
-    except sqlite3.OperationalError:
-        pass
+    return migrations.migrate(get_db())
 
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
 
 
 def ensure_default_admin():
@@ -124,7 +123,7 @@ def ensure_default_admin():
     cur.execute('SELECT * FROM users WHERE username=?', ('228820',))
     if not cur.fetchone():
         cur.execute('INSERT INTO users (username,password_hash,is_admin) VALUES (?,?,1)',
-                    ('228820', generate_password_hash('228820')))
+                    ('228820', hash_password('228820')))
         db.commit()
 
 
@@ -135,10 +134,55 @@ def query_db(query, args=(), one=False):
     return (rv[0] if rv else None) if one else rv
 
 
-def log_action(user_id, action):
-    db = get_db()
-    db.execute('INSERT INTO audit_logs (user_id, action) VALUES (?,?)', (user_id, action))
-    db.commit()
+VISIBLE_TO_GRADE = '''c.id IN (
+    SELECT content_id FROM content_grades WHERE grade=?
+    UNION ALL
+    SELECT id FROM contents WHERE grades IS NULL OR grades = ''
+)'''
+
+
+def visible_query(grade=None, category=None):
+    # contents with no grades are visible to everyone; the rest only to listed grades
+    query = Query('contents c', 'c.*, ' + render.COLUMNS).join(render.JOIN)
+    if grade is not None:
+        query.filter(VISIBLE_TO_GRADE, str(grade))
+    if category:
+        query.filter('c.id IN (SELECT content_id FROM content_categories WHERE category=?)', category)
+    return query
+
+
+def visible_contents(grade=None, category=None):
+    query = visible_query(grade, category)
+    return get_db().execute(*query.select('c.id DESC')).fetchall()
+
+
+def visible_categories(grade):
+    return facets.visible_categories(get_db(), grade)
+
+
+def generations():
+    return {r['name']: r['value'] for r in query_db('SELECT name, value FROM generations')}
+
+
+def bump_generation(db, name):
+    # call inside the write's transaction; invalidates caches keyed on it
+    db.execute('UPDATE generations SET value = value + 1 WHERE name=?', (name,))
+
+
+def content_validators(*parts):
+    # both from the generation rows, so Last-Modified moves whenever the ETag does
+    rows = query_db("SELECT name, value, changed_at FROM generations WHERE name IN ('contents', 'users')")
+    gens = {r['name']: r for r in rows}
+    etag = http_cache.make_etag(*parts, gens['contents']['value'], gens['users']['value'])
+    return etag, http_cache.parse_db_time(max(r['changed_at'] or '' for r in rows))
+
+
+def log_action(user_id, verb, target_type=None, target_id=None, label=None, db=None):
+    # with db: part of the caller's transaction; otherwise queued for the writer thread
+    if db is not None:
+        audit.write(db, user_id, verb, target_type, target_id, label)
+    else:
+        audit_writer.log(user_id, verb, target_type, target_id, label)
 
 
 @app.before_request
@@ -146,14 +190,34 @@ def set_csp_nonce():
     g.csp_nonce = secrets.token_urlsafe(16)
 
 
+@app.before_request
+def start_timing():
+    instrumentation.recorder.start()
+
+
+@app.after_request
+def record_timing(response):
+    timing = instrumentation.recorder.finish(request.endpoint or 'unmatched')
+    if timing:
+        total, queries, db_time = timing
+        response.headers['Server-Timing'] = (f'db;dur={db_time * 1000:.1f};desc="{queries} queries", '
+                                             f'app;dur={total * 1000:.1f}')
+    return response
+
+
 @app.after_request
 def set_security_headers(response):
     # CSP using per-request nonce for inline scripts/styles and allowing TinyMCE CDN
     nonce = getattr(g, 'csp_nonce', '')
     csp = f"default-src 'self' https:; script-src 'self' 'nonce-{nonce}' https://cdn.tiny.cloud; style-src 'self' 'nonce-{nonce}' https:;"
-    response.headers['Content-Security-Policy'] = csp
+    if response.status_code != 304:
+        # a 304 would overwrite the cached page's CSP with a nonce it doesn't use
+        response.headers['Content-Security-Policy'] = csp
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['X-Frame-Options'] = 'DENY'
+    if request.endpoint == 'static' and (request.view_args or {}).get('filename', '').startswith('uploads/'):
+        # uploads are named by content hash, so they never change
+        response.headers['Cache-Control'] = f'public, max-age={http_cache.IMMUTABLE_MAX_AGE}, immutable'
     return response
 
 
@@ -169,6 +233,13 @@ def login_required(f):
     return decorated
 
 
+def current_user():
+    # loaded once per request into g; decorators and views share it
+    if 'user' not in g:
+        g.user = principal_cache.get(get_db(), session['user_id']) if 'user_id' in session else None
+    return g.user
+
+
 def admin_required(f):
     from functools import wraps
 
@@ -176,7 +247,7 @@ def admin_required(f):
     def decorated(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        user = query_db('SELECT * FROM users WHERE id=?', (session['user_id'],), one=True)
+        user = current_user()
         if not user or not user['is_admin']:
             return 'Forbidden', 403
         return f(*args, **kwargs)
@@ -184,29 +255,145 @@ def admin_required(f):
     return decorated
 
 
+@app.route('/admin/upload_image', methods=['POST'])
+@admin_required
+def admin_upload_image():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file'}), 400
+    file = request.files['file']
+    url = save_upload_file(file)
+    if url:
+        return jsonify({'location': url})
+    return jsonify({'error': 'Invalid file'}), 400
+
+
+_bootstrapped = False
+_bootstrap_lock = threading.Lock()
+
+
+def bootstrap(start_jobs=True):
+    # schema migrations and the default admin; run once per process at startup
+    global _bootstrapped
+    with _bootstrap_lock, app.app_context():
+        applied = init_db()
+        ensure_default_admin()
+        if start_jobs:
+            start_background_jobs()
+        _bootstrapped = True
+    return applied
+
+
+def start_background_jobs():
+    # resume work left over from before a restart
+    with app.app_context():
+        variant_queue.enqueue_missing(get_db())
+        render_job.kick()
+
+
+def shutdown():
+    # stop background work and flush queued writes before the process exits
+    render_job.stop()
+    variant_queue.shutdown()
+    audit_writer.close()
+    password_pool.shutdown()
+    sanitizer.shutdown()
+    provisioning.shutdown()
+    db_pool.close_all()
+
+
 @app.before_request
-def setup():
-    init_db()
-    ensure_default_admin()
+def ensure_bootstrapped():
+    # for WSGI servers that import app:app without calling bootstrap()
+    if not _bootstrapped:
+        bootstrap()
+
+
+@app.route('/healthz')
+def healthz():
+    # liveness: the process answers
+    return 'ok', 200, {'Cache-Control': 'no-store'}
+
+
+@app.route('/readyz')
+def readyz():
+    # readiness: not shutting down, and the database answers at the latest schema
+    try:
+        version = migrations.current_version(get_db())
+    except sqlite3.Error:
+        version = None
+    ready = not serving.draining.is_set() and version == migrations.MIGRATIONS[-1][0]
+    resp = jsonify({'ready': ready, 'schema': version, 'draining': serving.draining.is_set()})
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp, 200 if ready else 503
+
+
+@app.cli.command('serve')
+@click.option('--host', default='0.0.0.0', show_default=True)
+@click.option('--port', default=5000, show_default=True, type=int)
+@click.option('--workers', type=int, help=f'Worker processes [default: CPU count, at most {serving.MAX_WORKERS}]')
+@click.option('--threads', default=serving.THREADS, show_default=True, type=int, help='Request threads per worker.')
+@click.option('--access-log/--no-access-log', default=False, show_default=True)
+@click.option('--graceful-timeout', default=serving.GRACEFUL_TIMEOUT, show_default=True, type=int,
+              help='Seconds workers get to finish requests when stopping.')
+def serve_command(host, port, workers, threads, access_log, graceful_timeout):
+    """Serve with pre-forked, multi-threaded workers (SIGHUP reloads gracefully)."""
+    serving.run(sys.modules[__name__], host, port, workers, threads, access_log, graceful_timeout)
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Apply pending schema migrations and create the default admin."""
+    applied = bootstrap()
+    click.echo(f'schema at version {migrations.MIGRATIONS[-1][0]} (applied: {applied or "none"})')
 
 
 @app.route('/')
 def index():
     if 'user_id' in session:
-        user = query_db('SELECT * FROM users WHERE id=?', (session['user_id'],), one=True)
+        user = current_user()
         if user and user['is_admin']:
             return redirect(url_for('admin_dashboard'))
         return redirect(url_for('user_dashboard'))
     return redirect(url_for('login'))
 
 
+def save_rehash(user_id, old_hash, new_hash):
+    # runs on a password pool thread, so on that thread's own connection
+    db = db_pool.connection()
+    try:
+        # unless the password was changed in the meantime
+        db.execute('UPDATE users SET password_hash=? WHERE id=? AND password_hash=?', (new_hash, user_id, old_hash))
+        db.commit()
+    finally:
+        db_pool.release(db)
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        if not (address_limiter.allow(request.remote_addr) and login_limiter.allow(username)):
+            flash('محاولات كثيرة، حاول لاحقا')
+            return render_template('login.html'), 429
         user = query_db('SELECT * FROM users WHERE username=?', (username,), one=True)
-        if user and check_password_hash(user['password_hash'], password):
+        try:
+            valid = bool(user) and password_pool.verify(user['password_hash'], password)
+        except passwords.Busy:
+            flash('الخادم مشغول، حاول بعد قليل')
+            resp = make_response(render_template('login.html'), 503)
+            resp.headers['Retry-After'] = '2'
+            return resp
+        if valid:
+            login_limiter.reset(username)
+            method = hash_method()
+            if passwords.needs_rehash(user['password_hash'], method):
+                # hash parameters changed since this one was made; rehashed
+                # in the background on the bounded pool
+                try:
+                    password_pool.rehash(password, method, partial(save_rehash, user['id'], user['password_hash']))
+                except passwords.Busy:
+                    pass  # tried again at the next login
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['is_admin'] = bool(user['is_admin'])
@@ -224,41 +411,31 @@ def logout():
 @app.route('/admin')
 @admin_required
 def admin_dashboard():
-    # pagination and optional search
-    page = int(request.args.get('page', 1))
+    # cursor pagination and optional search
     per_page = 20
-    offset = (page - 1) * per_page
-    q = request.args.get('q')
+    q = request.args.get('q', '').strip()
     # advanced filters
     grade_f = request.args.get('grade')
     category_f = request.args.get('category')
     author_f = request.args.get('author')
     starred_f = request.args.get('starred')
+    db = get_db()
+    uq = users_query()
+    cq = contents_query(grade_f, category_f, author_f, starred_f)
+    if q:
+        # ranked full-text results
+        users_order = search.filter_users(uq, q)
+        contents_order = search.filter_contents(cq, q)
+    users_total = db.execute(*uq.count()).fetchone()[0]
+    contents_total = db.execute(*cq.count()).fetchone()[0]
     if q:
-        users = query_db('SELECT * FROM users WHERE username LIKE ? ORDER BY id LIMIT ? OFFSET ?', (f'%{q}%', per_page, offset))
+        users = offset_page(db, uq, users_order, request.args.get('users_cursor'), per_page)
+        contents = offset_page(db, cq, contents_order, request.args.get('contents_cursor'), per_page)
     else:
-        users = query_db('SELECT * FROM users ORDER BY id LIMIT ? OFFSET ?', (per_page, offset))
-    contents = query_db('SELECT * FROM contents ORDER BY id DESC LIMIT ? OFFSET ?', (per_page, offset))
-    # apply filters in Python
-    def content_matches(c):
-        if grade_f and c['grades']:
-            if str(grade_f) not in c['grades'].split(','):
-                return False
-        if category_f and c['categories']:
-            if category_f not in [x.strip() for x in c['categories'].split(',')]:
-                return False
-        if author_f and str(c['author_id']) != str(author_f):
-            return False
-        if starred_f:
-            # filter by author starred flag
-            if starred_f == '1':
-                # check if author is starred
-                a = query_db('SELECT * FROM users WHERE id=?', (c['author_id'],), one=True)
-                if not a or not a['starred']:
-                    return False
-        return True
-    contents = [c for c in contents if content_matches(c)]
-    return render_template('admin_dashboard.html', users=users, contents=contents, page=page)
+        users = keyset_page(db, uq, [('id', 'id')], request.args.get('users_cursor'), per_page, descending=False)
+        contents = keyset_page(db, cq, [('c.id', 'id')], request.args.get('contents_cursor'), per_page)
+    return render_template('admin_dashboard.html', users=users, contents=contents,
+                           users_total=users_total, contents_total=contents_total)
 
 
 @app.route('/admin/users/add', methods=['GET', 'POST'])
@@ -271,23 +448,66 @@ def admin_add_user():
         if password:
             pw = password
         else:
-            try:
-                plen = int(get_setting('password_length', '8'))
-            except Exception:
-                plen = 8
+            plen = get_setting('password_length')
             pw = secrets.token_urlsafe(plen)[:plen]
         is_admin_flag = 1 if request.form.get('is_admin') == 'on' or request.form.get('role') == 'admin' else 0
         role = request.form.get('role') or 'user'
         db = get_db()
-        db.execute('INSERT INTO users (username,password_hash,grade,is_admin,role) VALUES (?,?,?,?,?)',
-                   (username, generate_password_hash(pw), grade, is_admin_flag, role))
+        cur = db.execute('INSERT INTO users (username,password_hash,grade,is_admin,role) VALUES (?,?,?,?,?)',
+                         (username, hash_password(pw), grade, is_admin_flag, role))
+        bump_generation(db, 'users')
+        log_action(session['user_id'], 'added', 'user', cur.lastrowid, username, db=db)
         db.commit()
         flash('تم إضافة المستخدم')
-        log_action(session['user_id'], f"added user:{username}")
         return redirect(url_for('admin_dashboard'))
     return render_template('admin_add_user.html')
 
 
+@app.route('/admin/users/provision', methods=['GET', 'POST'])
+@admin_required
+def admin_provision_users():
+    if request.method == 'POST':
+        f = request.files.get('csvfile')
+        if not f or not f.filename.lower().endswith('.csv'):
+            flash('ملف غير صحيح')
+            return redirect(url_for('admin_provision_users'))
+        report = run_provision(f.stream, session['user_id'])
+        # generated passwords are only ever shown in this download
+        resp = stream_export(exporters.csv_rows(report.rows, provisioning.CREDENTIAL_FIELDS), 'text/csv',
+                             'credentials.csv')
+        resp.headers['Cache-Control'] = 'no-store'
+        return resp
+    return render_template('admin_provision.html')
+
+
+def run_provision(stream, user_id):
+    db = get_db()
+    report = provisioning.provision(db, stream, get_setting('password_length'), hash_method())
+    if report.created:
+        bump_generation(db, 'users')
+    log_action(user_id, 'provisioned', 'users', label=f'{report.created} created, {report.skipped} skipped', db=db)
+    db.commit()
+    return report
+
+
+@app.cli.command('provision-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--out', type=click.File('w', encoding='utf-8'), default='-',
+              help='Where to write the credentials CSV (default: stdout).')
+@click.option('--user', 'username', default='228820', help='Username recorded in the audit log.')
+def provision_users_command(path, out, username):
+    """Create users from a CSV of username,grade and write their credentials."""
+    bootstrap()
+    admin = query_db('SELECT id FROM users WHERE username=?', (username,), one=True)
+    if not admin:
+        raise click.ClickException(f'unknown user {username}')
+    with open(path, 'rb') as f:
+        report = run_provision(f, admin['id'])
+    for chunk in exporters.csv_rows(report.rows, provisioning.CREDENTIAL_FIELDS):
+        out.write(chunk)
+    click.echo(f'created {report.created} users, skipped {report.skipped}', err=True)
+
+
 @app.route('/admin/users/edit/<int:user_id>', methods=['GET', 'POST'])
 @admin_required
 def admin_edit_user(user_id):
@@ -301,16 +521,18 @@ def admin_edit_user(user_id):
         starred = 1 if request.form.get('starred') == 'on' else 0
         db = get_db()
         is_admin_flag = 1 if request.form.get('is_admin') == 'on' or request.form.get('role') == 'admin' else 0
-        role = request.form.get('role') or user.get('role', 'user')
+        role = request.form.get('role') or user['role'] or 'user'
         if password:
             db.execute('UPDATE users SET username=?, password_hash=?, grade=?, starred=?, is_admin=?, role=? WHERE id=?',
-                       (username, generate_password_hash(password), grade, starred, is_admin_flag, role, user_id))
+                       (username, hash_password(password), grade, starred, is_admin_flag, role, user_id))
         else:
             db.execute('UPDATE users SET username=?, grade=?, starred=?, is_admin=?, role=? WHERE id=?',
                        (username, grade, starred, is_admin_flag, role, user_id))
+        bump_generation(db, 'users')
+        log_action(session['user_id'], 'edited', 'user', user_id, username, db=db)
         db.commit()
+        principal_cache.invalidate(user_id)
         flash('تم التحديث')
-        log_action(session['user_id'], f"edited user:{username}")
         return redirect(url_for('admin_dashboard'))
     return render_template('admin_edit_user.html', user=user)
 
@@ -332,17 +554,18 @@ def admin_add_content():
             if url:
                 link = link or url
         # sanitize HTML but allow basic tags
-        allowed_tags = ['p','b','i','u','a','img','ul','ol','li','br','strong','em','h1','h2','h3','h4','iframe','div','span']
-        allowed_attrs = {'a': ['href','target','rel'], 'img': ['src','alt','style'], 'iframe': ['src','width','height','frameborder','allow','allowfullscreen'], '*': ['style','class']}
-        safe_html = bleach.clean(html or '', tags=allowed_tags, attributes=allowed_attrs, strip=True)
+        safe_html = clean_html(html)
         db = get_db()
-        db.execute('INSERT INTO contents (title,html,link,categories,grades,author_id) VALUES (?,?,?,?,?,?)',
-                   (title, safe_html, link, categories, grades, session['user_id']))
+        cur = db.execute('INSERT INTO contents (title,html,link,categories,grades,author_id) VALUES (?,?,?,?,?,?)',
+                         (title, safe_html, link, categories, grades, session['user_id']))
+        sync_content_tags(db, cur.lastrowid, grades, categories, new=True)
+        render.store(db, [{'id': cur.lastrowid, 'title': title, 'html': safe_html}], sanitize_enabled())
+        bump_generation(db, 'contents')
+        log_action(session['user_id'], 'added', 'content', cur.lastrowid, title, db=db)
         db.commit()
         flash('تم إضافة المحتوى')
-        log_action(session['user_id'], f"added content:{title}")
         return redirect(url_for('admin_dashboard'))
-    users = query_db('SELECT DISTINCT grade FROM users ORDER BY grade')
+    users = facets.user_grades(get_db())
     return render_template('admin_add_content.html', users=users)
 
 
@@ -364,17 +587,18 @@ def admin_edit_content(cid):
             url = save_upload_file(f)
             if url:
                 link = link or url
-        allowed_tags = ['p','b','i','u','a','img','ul','ol','li','br','strong','em','h1','h2','h3','h4','iframe','div','span']
-        allowed_attrs = {'a': ['href','target','rel'], 'img': ['src','alt','style'], 'iframe': ['src','width','height','frameborder','allow','allowfullscreen'], '*': ['style','class']}
-        safe_html = bleach.clean(html or '', tags=allowed_tags, attributes=allowed_attrs, strip=True)
+        safe_html = clean_html(html)
         db = get_db()
         db.execute('UPDATE contents SET title=?,html=?,link=?,categories=?,grades=? WHERE id=?',
                    (title, safe_html, link, categories, grades, cid))
+        sync_content_tags(db, cid, grades, categories)
+        render.store(db, [{'id': cid, 'title': title, 'html': safe_html}], sanitize_enabled())
+        bump_generation(db, 'contents')
+        log_action(session['user_id'], 'edited', 'content', cid, title, db=db)
         db.commit()
         flash('تم التحديث')
-        log_action(session['user_id'], f"edited content:{title}")
         return redirect(url_for('admin_dashboard'))
-    users = query_db('SELECT DISTINCT grade FROM users ORDER BY grade')
+    users = facets.user_grades(get_db())
     return render_template('admin_edit_content.html', content=content, users=users)
 
 
@@ -384,139 +608,363 @@ def admin_preview():
     # preview all contents as a normal user would see them, with optional filters
     grade = request.args.get('grade')
     category = request.args.get('category')
-    q = 'SELECT * FROM contents'
-    rows = query_db(q)
-    if grade:
-        rows = [r for r in rows if (not r['grades']) or str(grade) in (r['grades'].split(','))]
-    if category:
-        rows = [r for r in rows if r['categories'] and category in r['categories'].split(',')]
-    grades = query_db('SELECT DISTINCT grade FROM users ORDER BY grade')
-    return render_template('admin_preview.html', contents=rows, grades=grades)
+    etag, last_modified = content_validators('preview', session['user_id'], grade or '', category or '')
+    if http_cache.is_fresh(etag, last_modified):
+        return http_cache.not_modified(etag, last_modified)
+    rows = visible_contents(grade or None, category)
+    grades = facets.user_grades(get_db())
+    resp = make_response(render_template('admin_preview.html', contents=feed_items(rows, full=True), grades=grades))
+    return http_cache.set_validators(resp, etag, last_modified)
 
 
 @app.route('/admin/export')
 @admin_required
 def admin_export():
-    contents = query_db('SELECT * FROM contents ORDER BY id DESC')
-    out = [dict(c) for c in contents]
-    return jsonify(out)
+    return export_contents_json()
+
+
+@app.route('/admin/cache-stats')
+@admin_required
+def admin_cache_stats():
+    return jsonify({'principals': principal_cache.stats(), 'fragments': dashboard_cache.stats(),
+                    'db_pool': db_pool.stats(), 'password_checks': password_pool.stats(),
+                    'slow_queries': list(instrumentation.recorder.slow)})
+
+
+@app.route('/admin/metrics')
+@admin_required
+def admin_metrics():
+    stats = {'db_pool': db_pool.stats(), 'fragments': dashboard_cache.stats(),
+             'principals': principal_cache.stats(), 'password_checks': password_pool.stats(),
+             'audit_writer': audit_writer.stats(), 'sanitizer': sanitizer.stats(),
+             'render_job': {'rendered': render_job.rendered}, 'settings': {'reloads': settings.reloads}}
+    return Response(instrumentation.recorder.render(stats), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/admin/audit')
 @admin_required
 def admin_audit():
-    logs = query_db('SELECT * FROM audit_logs ORDER BY ts DESC')
+    audit_writer.flush()
+    filters = {field: request.args.get(field) for field in ('verb', 'target_type', 'target_id')}
+    logs = audit_archive.page(get_db(), AUDIT_ARCHIVE_DIR, request.args.get('cursor'), 50, filters)
     return render_template('admin_audit.html', logs=logs)
 
 
+def archive_audit(days=None):
+    audit_writer.flush()
+    if days is None:
+        days = get_setting('audit_retention_days')
+    return audit_archive.archive(get_db(), AUDIT_ARCHIVE_DIR, days)
+
+
+@app.route('/admin/audit/archive', methods=['POST'])
+@admin_required
+def admin_audit_archive():
+    moved = archive_audit()
+    flash(f'تمت أرشفة {moved} سجل')
+    return redirect(url_for('admin_audit'))
+
+
+@app.cli.command('archive-audit')
+@click.option('--days', type=int, default=None, help='Retention in days (default: the audit_retention_days setting).')
+def archive_audit_command(days):
+    """Move old audit log rows into compressed archive segments."""
+    bootstrap()
+    with app.app_context():
+        moved = archive_audit(days)
+    click.echo(f'archived {moved} audit rows to {AUDIT_ARCHIVE_DIR}')
+
+
 @app.route('/admin/export/csv')
 @admin_required
 def admin_export_csv():
-    import csv
-    from io import StringIO
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['id','ts','user_id','action'])
-    for l in query_db('SELECT * FROM audit_logs ORDER BY ts DESC'):
-        writer.writerow([l['id'], l['ts'], l['user_id'], l['action']])
-    return si.getvalue(), 200, {'Content-Type': 'text/csv', 'Content-Disposition': 'attachment; filename="audit.csv"'}
+    audit_writer.flush()
+    # audit_logs is append-only and archiving only moves rows out of it,
+    # so the live id range plus the archive count identify the contents
+    bounds = query_db('''SELECT MIN(id) AS lo, MAX(id) AS hi,
+                                (SELECT COUNT(*) FROM audit_archives) AS segments FROM audit_logs''', one=True)
+    etag = http_cache.make_etag('audit', bounds['lo'], bounds['hi'], bounds['segments'])
+    if http_cache.is_fresh(etag):
+        return http_cache.not_modified(etag)
+    entries = audit_archive.iter_entries(get_db(), AUDIT_ARCHIVE_DIR)
+    resp = stream_export(exporters.csv_rows(entries, list(audit_archive.COLUMNS)), 'text/csv', 'audit.csv')
+    return http_cache.set_validators(resp, etag)
+
+
+def stream_export(chunks, mimetype, filename=None):
+    # chunked response; gzip when the client accepts it
+    gzip = bool(request.accept_encodings['gzip'])
+    resp = Response(stream_with_context(exporters.encode(chunks, gzip)), mimetype=mimetype)
+    if gzip:
+        resp.headers['Content-Encoding'] = 'gzip'
+        resp.headers['Vary'] = 'Accept-Encoding'
+    if filename:
+        resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return resp
 
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    resp = send_from_directory(UPLOAD_FOLDER, filename, max_age=http_cache.IMMUTABLE_MAX_AGE)
+    resp.cache_control.immutable = True
+    return resp
+
+
+def hash_method():
+    return passwords.method_string(get_setting('password_hash_method'), get_setting('password_hash_iterations'))
+
+
+def hash_password(password, method=None):
+    return passwords.hash_password(password, method or hash_method())
 
 
 def get_setting(key, default=None):
-    r = query_db('SELECT value FROM settings WHERE key=?', (key,), one=True)
-    return r['value'] if r else default
+    # typed, from the in-memory settings store (see settings_store.SETTINGS)
+    return settings.get(get_db(), key, default)
+
+
+def sanitize_enabled():
+    return get_setting('sanitize_html')
+
+
+def clean_html(html):
+    # honours the sanitize_html setting from /admin/settings
+    if not sanitize_enabled():
+        return html or ''
+    return sanitizer.sanitize(html)
+
+
+def clean_html_many(htmls):
+    if not sanitize_enabled():
+        return [h or '' for h in htmls]
+    return sanitizer.sanitize_many(htmls)
+
+
+PASSWORD_HASH_METHODS = ('pbkdf2:sha256', 'pbkdf2:sha512', 'scrypt')
 
 
 @app.route('/admin/settings', methods=['GET', 'POST'])
 @admin_required
 def admin_settings():
     if request.method == 'POST':
-        pw_len = request.form.get('password_length') or '8'
-        sanitize = '1' if request.form.get('sanitize') == 'on' else '0'
-        db = get_db()
-        db.execute('REPLACE INTO settings (key,value) VALUES (?,?)', ('password_length', str(pw_len)))
-        db.execute('REPLACE INTO settings (key,value) VALUES (?,?)', ('sanitize_html', sanitize))
-        db.commit()
+        values = {'sanitize_html': request.form.get('sanitize') == 'on'}
+        for key in ('password_length', 'audit_retention_days', 'password_hash_iterations'):
+            value = request.form.get(key, '').strip()
+            if value.isdigit() and int(value) > 0:
+                values[key] = int(value)
+        if request.form.get('password_hash_method') in PASSWORD_HASH_METHODS:
+            values['password_hash_method'] = request.form['password_hash_method']
+        settings.set_many(get_db(), values)
+        # the sanitize flag is part of the render version
+        render_job.kick()
         flash('تم حفظ الاعدادات')
         return redirect(url_for('admin_settings'))
-    pw_len = get_setting('password_length', '8')
-    sanitize = get_setting('sanitize_html', '1')
-    return render_template('admin_settings.html', password_length=pw_len, sanitize=(sanitize=='1'))
+    current = settings.all(get_db())
+    return render_template('admin_settings.html', password_length=current['password_length'],
+                           sanitize=current['sanitize_html'],
+                           audit_retention_days=current['audit_retention_days'],
+                           hash_methods=PASSWORD_HASH_METHODS,
+                           password_hash_method=current['password_hash_method'],
+                           password_hash_iterations=current['password_hash_iterations'])
+
+
+IMPORT_EXTS = ('.json', '.ndjson', '.jsonl')
 
 
 @app.route('/admin/contents/import', methods=['GET', 'POST'])
 @admin_required
 def admin_import_contents():
     if request.method == 'POST':
-        import json
         if 'jsonfile' not in request.files:
             flash('رجاء حدد ملف')
             return redirect(url_for('admin_import_contents'))
         f = request.files['jsonfile']
-        if not f or not f.filename.endswith('.json'):
+        if not f or not f.filename.endswith(IMPORT_EXTS):
             flash('ملف غير صحيح')
             return redirect(url_for('admin_import_contents'))
         try:
-            data = json.loads(f.read().decode('utf-8'))
-            db = get_db()
-            imported = 0
-            if not isinstance(data, list):
-                data = [data]
-            for item in data:
-                # check if exists by id (skip duplicates by default)
-                if db.execute('SELECT id FROM contents WHERE id=?', (item.get('id'),)).fetchone():
-                    continue
-                title = item.get('title', '')
-                html = item.get('html', '')
-                link = item.get('link', '')
-                categories = item.get('categories', '')
-                grades = item.get('grades', '')
-                safe_html = bleach.clean(html or '', tags=['p','b','i','u','a','img','ul','ol','li','br','strong','em','h1','h2','h3','h4','iframe','div','span'], attributes={'a': ['href','target','rel'], 'img': ['src','alt','style'], 'iframe': ['src','width','height','frameborder','allow','allowfullscreen'], '*': ['style','class']}, strip=True)
-                db.execute('INSERT INTO contents (title,html,link,categories,grades,author_id) VALUES (?,?,?,?,?,?)',
-                           (title, safe_html, link, categories, grades, session['user_id']))
-                imported += 1
-            db.commit()
-            flash(f'تم استيراد {imported} محتوى')
-            log_action(session['user_id'], f"imported {imported} contents from JSON")
+            report = run_import(f.stream, session['user_id'])
+            flash(f'تم استيراد {report.imported} محتوى')
+            if report.skipped:
+                flash(f'تم تخطي {report.skipped} محتوى موجود مسبقا')
+            for index, message in report.errors[:5]:
+                flash(f'خطأ في العنصر {index}: {message}')
             return redirect(url_for('admin_dashboard'))
         except Exception as e:
             flash(f'خطأ: {str(e)}')
     return render_template('admin_import.html')
 
 
+def run_import(stream, user_id, progress=None):
+    db = get_db()
+    report = importer.import_contents(db, stream, user_id, clean_html_many, progress=progress)
+    if report.imported:
+        bump_generation(db, 'contents')
+        db.commit()
+        render_job.kick()
+    log_action(user_id, 'imported', 'contents', label=f'{report.imported} from JSON')
+    return report
+
+
+@app.cli.command('import-contents')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'username', default='228820', help='Username recorded as the author.')
+def import_contents_command(path, username):
+    """Bulk import contents from a JSON or NDJSON file."""
+    bootstrap()
+    user = query_db('SELECT id FROM users WHERE username=?', (username,), one=True)
+    if not user:
+        raise click.ClickException(f'unknown user {username}')
+
+    def progress(report):
+        click.echo(f'  {report.processed} items: {report.imported} imported, '
+                   f'{report.skipped} skipped, {len(report.errors)} errors')
+
+    with open(path, 'rb') as f:
+        report = run_import(f, user['id'], progress)
+    for index, message in report.errors:
+        click.echo(f'item {index}: {message}', err=True)
+    click.echo(f'imported {report.imported} contents')
+
+
 @app.route('/admin/contents/export/json')
 @admin_required
 def admin_export_contents_json():
-    contents = query_db('SELECT * FROM contents ORDER BY id DESC')
-    out = [dict(c) for c in contents]
-    return jsonify(out)
+    return export_contents_json()
+
+
+def export_contents_json():
+    # ?limit=N pages through the export with a Link: rel="next" cursor,
+    # otherwise the whole table is streamed, as a JSON array or ?format=ndjson
+    etag, last_modified = content_validators('export', request.query_string.decode())
+    if http_cache.is_fresh(etag, last_modified):
+        return http_cache.not_modified(etag, last_modified)
+    limit = request.args.get('limit', type=int)
+    if not limit:
+        cur = get_db().execute('SELECT * FROM contents ORDER BY id DESC')
+        if request.args.get('format') == 'ndjson':
+            resp = stream_export(exporters.ndjson(cur), 'application/x-ndjson')
+        else:
+            resp = stream_export(exporters.json_array(cur), 'application/json')
+        return http_cache.set_validators(resp, etag, last_modified)
+    limit = max(1, min(limit, 1000))
+    page = keyset_page(get_db(), Query('contents'), [('id', 'id')], request.args.get('cursor'), limit)
+    resp = jsonify([dict(c) for c in page])
+    if page.next_cursor:
+        next_url = url_for(request.endpoint, limit=limit, cursor=page.next_cursor, _external=True)
+        resp.headers['Link'] = f'<{next_url}>; rel="next"'
+    return http_cache.set_validators(resp, etag, last_modified)
+
+FEED_PAGE = 20
+
+
+def feed_items(rows, full=False):
+    # precomputed fragments; stale ones are rendered here and queued for the job
+    fragments, stale = render.fragments(get_db(), rows, sanitize_enabled())
+    if stale:
+        render_job.kick()
+    items = []
+    for row, (body, summary, card) in zip(rows, fragments):
+        item = {'id': row['id'], 'title': row['title'], 'link': row['link'],
+                'grades': row['grades'], 'categories': row['categories']}
+        if full:
+            item['html'] = body
+        else:
+            item['excerpt'] = summary
+            item['card'] = card
+        items.append(item)
+    return items
+
+
+def cards(rows):
+    return Markup(''.join(item['card'] for item in feed_items(rows)))
+
+
+def feed_page(user, cursor=None, grade=None, category=None, limit=FEED_PAGE, q=None):
+    # grade narrows the user's own visible set, like the sidebar grade links
+    query = visible_query(user['grade'], category)
+    if grade:
+        query.filter(VISIBLE_TO_GRADE, str(grade))
+    if q and search.match_expression(q):
+        # ranked, so paged by offset
+        return offset_page(get_db(), query, search.filter_contents(query, q), cursor, limit)
+    return keyset_page(get_db(), query, [('c.id', 'id')], cursor, limit)
+
+
+@app.route('/api/contents')
+@login_required
+def api_contents():
+    user = current_user()
+    if not user:
+        return jsonify({'error': 'unauthorized'}), 401
+    args = request.args
+    try:
+        limit = min(max(int(args.get('limit', FEED_PAGE)), 1), 100)
+    except ValueError:
+        limit = FEED_PAGE
+    full = args.get('summary') == '0'
+    etag, last_modified = content_validators('feed', user['grade'], request.query_string.decode('latin-1'))
+    if http_cache.is_fresh(etag, last_modified):
+        return http_cache.not_modified(etag, last_modified)
+    page = feed_page(user, args.get('cursor'), args.get('grade'), args.get('category'), limit,
+                     args.get('q', '').strip())
+    next_url = None
+    if page.next_cursor:
+        next_url = url_for('api_contents', **dict(args.to_dict(), cursor=page.next_cursor))
+    resp = jsonify({'items': feed_items(page.rows, full),
+                    'next_cursor': page.next_cursor, 'next': next_url})
+    return http_cache.set_validators(resp, etag, last_modified)
+
+
+@app.route('/api/contents/<int:cid>')
+@login_required
+def api_content(cid):
+    user = current_user()
+    if not user:
+        return jsonify({'error': 'unauthorized'}), 401
+    etag, last_modified = content_validators('content', cid, user['grade'])
+    if http_cache.is_fresh(etag, last_modified):
+        return http_cache.not_modified(etag, last_modified)
+    query = visible_query(user['grade']).filter('c.id = ?', cid)
+    row = get_db().execute(*query.select()).fetchone()
+    if row is None:
+        return jsonify({'error': 'not found'}), 404
+    return http_cache.set_validators(jsonify(feed_items([row], full=True)[0]), etag, last_modified)
+
 
 @app.route('/user')
 @login_required
 def user_dashboard():
-    user = query_db('SELECT * FROM users WHERE id=?', (session['user_id'],), one=True)
-    all_contents = query_db('SELECT * FROM contents ORDER BY id DESC')
-    visible = []
-    for c in all_contents:
-        if not c['grades']:
-            visible.append(c)
-        else:
-            gstrs = c['grades'].split(',')
-            if str(user['grade']) in gstrs:
-                visible.append(c)
-    categories = set()
-    for c in visible:
-        if c['categories']:
-            categories.update([x.strip() for x in c['categories'].split(',') if x.strip()])
-    # sidebar grades
-    grades = sorted(set([r['grade'] for r in query_db('SELECT grade FROM users') if r['grade']]))
-    return render_template('user_dashboard.html', contents=visible, categories=sorted(categories), grades=grades)
+    q = request.args.get('q', '').strip()
+    etag, last_modified = content_validators('user', session['user_id'], q)
+    if http_cache.is_fresh(etag, last_modified):
+        return http_cache.not_modified(etag, last_modified)
+    user = current_user()
+    if not user:
+        session.clear()
+        return redirect(url_for('login'))
+    gens = generations()
+    generation = (gens['contents'], gens['users'])
+    fragments = dashboard_cache.get(user['grade'], generation)
+    if fragments is None:
+        first = feed_page(user)
+        categories = visible_categories(user['grade'])
+        # sidebar grades
+        grades = [r['grade'] for r in facets.user_grades(get_db()) if r['grade']]
+        fragments = (render_template('user_dashboard_sidebar.html', categories=categories, grades=grades),
+                     render_template('user_dashboard_contents.html', cards=cards(first.rows),
+                                     next_cursor=first.next_cursor))
+        dashboard_cache.put(user['grade'], generation, fragments)
+    if q:
+        # search results are per query, so only the sidebar comes from the cache
+        results = feed_page(user, q=q)
+        fragments = (fragments[0], render_template('user_dashboard_contents.html', cards=cards(results.rows),
+                                                   next_cursor=results.next_cursor, q=q))
+    resp = make_response(render_template('user_dashboard.html', sidebar=Markup(fragments[0]),
+                                         contents=Markup(fragments[1]), q=q))
+    return http_cache.set_validators(resp, etag, last_modified)
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    bootstrap()
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,141 @@
+"""
+Audit log writer.
+
+Events are queued in memory and written in batches by one background
+thread, flushed when the batch fills up, after flush_interval seconds, on
+flush() and always on close(). write() instead adds the event to the caller's open
+transaction so it commits (or rolls back) with the change it describes.
+
+Events carry structured fields (verb, target_type, target_id) next to the
+human-readable action text, so per-target queries can use an index.
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+log = logging.getLogger(__name__)
+
+INSERT = '''INSERT INTO audit_logs (ts, user_id, verb, target_type, target_id, action)
+            VALUES (?,?,?,?,?,?)'''
+
+
+def now():
+    # same format as CURRENT_TIMESTAMP, so ordering by ts keeps working
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def event(user_id, verb, target_type=None, target_id=None, label=None):
+    action = verb
+    if target_type:
+        action += f' {target_type}:{label if label is not None else target_id}'
+    return (now(), user_id, verb, target_type, target_id, action)
+
+
+def write(db, user_id, verb, target_type=None, target_id=None, label=None):
+    """Insert in the current transaction of db; the caller commits."""
+    db.execute(INSERT, event(user_id, verb, target_type, target_id, label))
+
+
+class AuditWriter:
+    """connect() must return a connection usable on the writer thread."""
+
+    def __init__(self, connect, batch_size=100, flush_interval=1.0):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+
+    def log(self, user_id, verb, target_type=None, target_id=None, label=None):
+        if self._closed:
+            # after shutdown there is no writer thread; write synchronously
+            self._write([event(user_id, verb, target_type, target_id, label)])
+            return
+        self._start()
+        self._queue.put(event(user_id, verb, target_type, target_id, label))
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='audit-writer', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            if isinstance(item, threading.Event):
+                # flush() with nothing pending
+                self._queue.task_done()
+                item.set()
+                continue
+            batch = [item]
+            stop = False
+            flushed = None
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    flushed = item
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+            except sqlite3.Error:
+                log.exception('dropped %d audit events', len(batch))
+            finally:
+                for _ in range(len(batch) + stop + (flushed is not None)):
+                    self._queue.task_done()
+                if flushed:
+                    flushed.set()
+            if stop:
+                return
+
+    def _write(self, batch):
+        db = self.connect()
+        with db:
+            db.executemany(INSERT, batch)
+        self.written += len(batch)
+        self.batches += 1
+
+    def flush(self):
+        """Write everything queued so far now and wait until it is written."""
+        done = threading.Event()
+        # under the lock, so it cannot land behind close()'s stop marker
+        with self._lock:
+            if self._closed or self._thread is None or not self._thread.is_alive():
+                return
+            self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'written': self.written, 'batches': self.batches}
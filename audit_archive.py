@@ -0,0 +1,179 @@
+"""
+Audit log retention.
+
+Rows older than the retention period are moved out of audit_logs into
+gzip-compressed NDJSON segments, one per day (more if late rows turn up for
+an already archived day), and recorded in the audit_archives manifest with
+their id and timestamp range. Freed pages are returned with an incremental
+vacuum. iter_entries() reads live rows and archived segments as one stream
+in (ts, id) order, so the audit page and CSV export cover both.
+"""
+
+import gzip
+import heapq
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+
+from pagination import Page, decode_cursor, encode_cursor
+
+log = logging.getLogger(__name__)
+
+COLUMNS = ('id', 'ts', 'user_id', 'verb', 'target_type', 'target_id', 'action')
+DEFAULT_RETENTION_DAYS = 90
+VACUUM_PAGES = 2000
+
+
+def segment_name(day, min_id):
+    return f'audit-{day}-{min_id}.ndjson.gz'
+
+
+def _write_segment(path, rows):
+    tmp = path + '.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8') as out:
+        for r in rows:
+            out.write(json.dumps(dict(zip(COLUMNS, r)), ensure_ascii=False) + '\n')
+    with open(tmp, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def archive(db, folder, days=DEFAULT_RETENTION_DAYS, today=None):
+    """
+    Move whole days older than `days` into segments; returns the rows moved.
+
+    Each day is one transaction: the segment is written and renamed into
+    place before the manifest row is added and the live rows deleted, so a
+    crash leaves at most an orphan file that the next run overwrites.
+    """
+    os.makedirs(folder, exist_ok=True)
+    today = today or datetime.now(timezone.utc).date()
+    cutoff = (today - timedelta(days=days)).isoformat()
+    moved = 0
+    while True:
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT MIN(ts) FROM audit_logs WHERE ts < ?', (cutoff,)).fetchone()
+            if row[0] is None:
+                db.rollback()
+                break
+            day = row[0][:10]
+            next_day = (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+            rows = db.execute(f'''SELECT {", ".join(COLUMNS)} FROM audit_logs
+                                  WHERE ts >= ? AND ts < ? ORDER BY ts, id''', (day, next_day)).fetchall()
+            ids = [r[0] for r in rows]
+            name = segment_name(day, min(ids))
+            _write_segment(os.path.join(folder, name), rows)
+            db.execute('''INSERT OR REPLACE INTO audit_archives
+                          (filename, day, min_id, max_id, min_ts, max_ts, rows) VALUES (?,?,?,?,?,?,?)''',
+                       (name, day, min(ids), max(ids), rows[0][1], rows[-1][1], len(rows)))
+            db.execute('DELETE FROM audit_logs WHERE ts >= ? AND ts < ?', (day, next_day))
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        moved += len(rows)
+    if moved:
+        vacuum(db)
+    return moved
+
+
+def vacuum(db, pages=VACUUM_PAGES):
+    # only does anything once auto_vacuum is INCREMENTAL (see migrations.migrate)
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        log.warning('auto_vacuum is not INCREMENTAL, archived rows leave free pages behind; restart to convert')
+        return
+    # executescript steps the pragma to completion; execute() frees one page
+    db.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+
+
+def _read_segment(folder, filename):
+    try:
+        with gzip.open(os.path.join(folder, filename), 'rt', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _key(row):
+    return (row['ts'], row['id'])
+
+
+def _matches(row, filters):
+    return all(str(row.get(k)) == str(v) for k, v in filters.items())
+
+
+def _live(db, after, descending, filters):
+    where, args = [], []
+    if after:
+        where.append(f'(ts, id) {"<" if descending else ">"} (?, ?)')
+        args += list(after)
+    for k, v in filters.items():
+        where.append(f'{k} = ?')
+        args.append(v)
+    sql = f'SELECT {", ".join(COLUMNS)} FROM audit_logs'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    order = 'DESC' if descending else 'ASC'
+    cur = db.execute(sql + f' ORDER BY ts {order}, id {order}', args)
+    for r in cur:
+        yield dict(r)
+
+
+def _archived(db, folder, after, descending, filters):
+    bound_col = 'max_ts' if descending else 'min_ts'
+    sql = f'SELECT filename, {bound_col} AS bound FROM audit_archives'
+    args = []
+    if after:
+        # segments wholly on the wrong side of the cursor are skipped unread
+        sql += ' WHERE min_ts <= ?' if descending else ' WHERE max_ts >= ?'
+        args.append(after[0])
+    order = 'DESC' if descending else 'ASC'
+    segments = db.execute(sql + f' ORDER BY {bound_col} {order}, min_id {order}', args).fetchall()
+    # segments are read one at a time; they only overlap when late rows for a
+    # day were archived separately, so rows are held back until no later
+    # segment can sort before them
+    pending = []
+    for seg in segments:
+        ready = [r for r in pending if (r['ts'] > seg['bound']) == descending and r['ts'] != seg['bound']]
+        pending = pending[len(ready):]
+        yield from ready
+        rows = [r for r in _read_segment(folder, seg['filename']) if _matches(r, filters)]
+        if after:
+            rows = [r for r in rows if (_key(r) < tuple(after)) == descending and _key(r) != tuple(after)]
+        pending = sorted(pending + rows, key=_key, reverse=descending)
+    yield from pending
+
+
+def iter_entries(db, folder, after=None, descending=True, filters=None):
+    """Live and archived audit rows as dicts, newest first unless descending=False."""
+    filters = {k: v for k, v in (filters or {}).items() if v not in (None, '')}
+    return heapq.merge(_live(db, after, descending, filters), _archived(db, folder, after, descending, filters),
+                       key=_key, reverse=descending)
+
+
+def page(db, folder, cursor=None, limit=50, filters=None):
+    """One pagination.Page of iter_entries(), newest first, with keyset cursors on (ts, id)."""
+    decoded = decode_cursor(cursor)
+    # the key is compared with (ts, id) tuples, so anything else is rejected
+    if decoded and not (len(decoded[0]) == 2 and isinstance(decoded[0][0], str)
+                        and isinstance(decoded[0][1], int) and not isinstance(decoded[0][1], bool)):
+        decoded = None
+    backwards = bool(decoded) and decoded[1] == 'p'
+    entries = iter_entries(db, folder, decoded[0] if decoded else None, not backwards, filters)
+    rows = []
+    for row in entries:
+        rows.append(row)
+        if len(rows) > limit:
+            break
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return Page(rows)
+    first, last = list(_key(rows[0])), list(_key(rows[-1]))
+    if backwards:
+        return Page(rows, encode_cursor(last, 'n'), encode_cursor(first, 'p') if more else None)
+    return Page(rows, encode_cursor(last, 'n') if more else None, encode_cursor(first, 'p') if decoded else None)
@@ -0,0 +1 @@
+"""Benchmarks for the CMS app. Run modules with `python -m benchmarks.<name>`."""
@@ -0,0 +1,73 @@
+"""
+Per-request cost of the old before_request setup() hook versus bootstrapping
+once at startup.
+
+    python -m benchmarks.bootstrap_overhead [--requests N]
+
+Runs against a throwaway database in a temp directory.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def legacy_setup(app_module):
+    # what setup() used to do on every request
+    db = app_module.get_db()
+    db.executescript('''
+    CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL, grade INTEGER DEFAULT 0, is_admin INTEGER DEFAULT 0, starred INTEGER DEFAULT 0);
+    CREATE TABLE IF NOT EXISTS contents (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, html TEXT, link TEXT,
+        categories TEXT, grades TEXT, author_id INTEGER, FOREIGN KEY(author_id) REFERENCES users(id));
+    CREATE TABLE IF NOT EXISTS audit_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+        user_id INTEGER, action TEXT);
+    CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+    ''')
+    db.commit()
+    try:
+        db.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'user'")
+        db.commit()
+    except sqlite3.OperationalError:
+        pass
+    app_module.ensure_default_admin()
+
+
+def timed(client, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get('/login')
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='cms-bench-'))
+    import app as app_module
+    app_module.bootstrap()
+    client = app_module.app.test_client()
+    hooks = app_module.app.before_request_funcs.setdefault(None, [])
+
+    timed(client, 50)
+    once = timed(client, args.requests)
+    hooks.append(lambda: legacy_setup(app_module))
+    timed(client, 50)
+    legacy = timed(client, args.requests)
+    hooks.pop()
+
+    print(f'GET /login x{args.requests}')
+    print(f'  setup() on every request : {legacy * 1e6:8.1f} us/request')
+    print(f'  bootstrap once at startup: {once * 1e6:8.1f} us/request')
+    print(f'  saving                   : {(legacy - once) * 1e6:8.1f} us/request ({(1 - once / legacy) * 100:.0f}%)')
+
+
+if __name__ == '__main__':
+    main()
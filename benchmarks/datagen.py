@@ -0,0 +1,133 @@
+"""
+Deterministic synthetic data for benchmarks.
+
+    python -m benchmarks.datagen [--dir DIR] [--users N] [--contents M] [--audit K] [--seed S]
+
+Fills DIR/data.db (a new temp directory by default) through the app's own
+schema and import path: N users spread across grades, M contents with CSV
+grades and categories, and K audit rows over the 120 days before a fixed
+date. The same arguments always give the same data. Every generated user
+has the password PASSWORD.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'bench-password'
+GRADES = range(1, 13)
+CATEGORIES = ['رياضيات', 'علوم', 'لغة عربية', 'English', 'تاريخ', 'جغرافيا', 'حاسب', 'فنون']
+WORDS = ['الدرس', 'الوحدة', 'تمارين', 'مراجعة', 'اختبار', 'ملخص', 'شرح', 'الفصل', 'أنشطة', 'قراءة',
+         'lesson', 'review', 'worksheet', 'notes', 'quiz', 'chapter']
+VERBS = ['logged in', 'added', 'edited', 'deleted', 'starred', 'imported']
+# audit timestamps count back from here, so they do not depend on the run date
+AUDIT_END = datetime(2024, 6, 1)
+AUDIT_DAYS = 120
+
+
+def _sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def content_items(count, seed=0):
+    """Import items (dicts) as importer.import_contents reads them."""
+    rng = random.Random(f'contents-{seed}')
+    items = []
+    for i in range(count):
+        grades = ','.join(str(g) for g in sorted(rng.sample(GRADES, rng.choice((0, 1, 1, 2, 3)))))
+        categories = ','.join(rng.sample(CATEGORIES, rng.randint(1, 2)))
+        paragraphs = ''.join(f'<p>{_sentence(rng, rng.randint(20, 60))}</p>' for _ in range(rng.randint(1, 4)))
+        items.append({'title': f'{_sentence(rng, 3)} {i}', 'html': f'<h3>{_sentence(rng, 2)}</h3>{paragraphs}'
+                      '<ul><li><b>' + _sentence(rng, 4) + '</b></li></ul>',
+                      'link': f'https://example.com/c/{i}' if rng.random() < 0.3 else '',
+                      'grades': grades, 'categories': categories})
+    return items
+
+
+def user_rows(count, password_hash, seed=0):
+    rng = random.Random(f'users-{seed}')
+    return [(f'student{i:06d}', password_hash, rng.choice(GRADES), 0, 'user') for i in range(count)]
+
+
+def audit_rows(count, user_ids, seed=0):
+    rng = random.Random(f'audit-{seed}')
+    span = AUDIT_DAYS * 86400
+    rows = []
+    for i in range(count):
+        # spread evenly over the span, oldest first, like a real log
+        ts = AUDIT_END - timedelta(seconds=span - i * span // max(count, 1))
+        verb = rng.choice(VERBS)
+        target_id = rng.randint(1, 1000) if verb not in ('logged in', 'imported') else None
+        target_type = 'content' if target_id else None
+        action = verb + (f' {target_type}:{target_id}' if target_id else '')
+        rows.append((ts.strftime('%Y-%m-%d %H:%M:%S'), rng.choice(user_ids), verb, target_type, target_id, action))
+    return rows
+
+
+def generate(app_module, users=1000, contents=2000, audit=10000, seed=0):
+    """Fill the app's database (which must be bootstrapped and empty)."""
+    import audit as audit_log
+    import importer
+    import sanitizer
+
+    with app_module.app.app_context():
+        db = app_module.get_db()
+        admin_id = db.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+        # one hash for everybody; hashing each would take minutes by design
+        password_hash = app_module.hash_password(PASSWORD)
+        db.executemany('INSERT INTO users (username, password_hash, grade, is_admin, role) VALUES (?,?,?,?,?)',
+                       user_rows(users, password_hash, seed))
+        app_module.bump_generation(db, 'users')
+        db.commit()
+
+        stream = io.BytesIO(json.dumps(content_items(contents, seed), ensure_ascii=False).encode())
+        importer.import_contents(db, stream, admin_id, sanitizer.sanitize_many)
+        app_module.bump_generation(db, 'contents')
+        db.commit()
+        # render now rather than leaving it to the background job, so
+        # measurements start from a steady state
+        while app_module.render_job.run_batch():
+            pass
+
+        user_ids = [r[0] for r in db.execute('SELECT id FROM users')]
+        db.executemany(audit_log.INSERT, audit_rows(audit, user_ids, seed))
+        db.commit()
+
+
+def prepare(folder=None, users=1000, contents=2000, audit=10000, seed=0):
+    """
+    Bootstrap the app in folder (a new temp directory by default) and fill
+    its database; returns the app module. Changes the working directory.
+    """
+    os.chdir(folder or tempfile.mkdtemp(prefix='cms-bench-'))
+    import app as app_module
+    app_module.bootstrap()
+    generate(app_module, users, contents, audit, seed)
+    return app_module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dir', help='directory for data.db (default: a new temp directory)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--contents', type=int, default=2000)
+    parser.add_argument('--audit', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.dir:
+        os.makedirs(args.dir, exist_ok=True)
+        if os.path.exists(os.path.join(args.dir, 'data.db')):
+            parser.error(f'{args.dir} already has a data.db')
+    prepare(args.dir, args.users, args.contents, args.audit, args.seed)
+    print(f'{os.getcwd()}/data.db: {args.users} users, {args.contents} contents, {args.audit} audit rows')
+
+
+if __name__ == '__main__':
+    main()
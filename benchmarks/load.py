@@ -0,0 +1,275 @@
+"""
+Load test of the main CMS routes.
+
+    python -m benchmarks.load [--mode client|server|both] [--requests N] [--concurrency C]
+                              [--users N] [--contents M] [--audit K] [--output FILE] [--baseline FILE]
+
+Fills a throwaway database with benchmarks.datagen, then sends N requests per
+scenario from C threads, through Flask's test client (in-process) and/or
+through a local threaded WSGI server over HTTP. Prints a JSON report with
+throughput and p50/p99 latency per scenario and the peak RSS of the whole
+run (data generation, client threads and the in-process server share one
+process, so there is no per-scenario peak), tagged with the current commit;
+--baseline compares against an earlier report.
+
+CSRF checks are turned off so the import can be posted without a form
+round trip. The import scenario adds rows, so later scenarios of the same
+run see a slightly larger table.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from benchmarks import datagen
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_ITEMS = 20
+BOUNDARY = 'cms-bench-boundary'
+
+
+def peak_rss_kib():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def session_cookie(app, **values):
+    # what the login view would have put in the session, signed the same way
+    serializer = app.session_interface.get_signing_serializer(app)
+    return f"{app.config['SESSION_COOKIE_NAME']}={serializer.dumps(values)}"
+
+
+def import_body(seed):
+    payload = json.dumps(datagen.content_items(IMPORT_ITEMS, seed=f'import-{seed}'), ensure_ascii=False)
+    body = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="jsonfile"; filename="bench.json"\r\n'
+            f'Content-Type: application/json\r\n\r\n{payload}\r\n--{BOUNDARY}--\r\n')
+    return body.encode()
+
+
+def scenarios(app_module, seed):
+    """(name, method, path, body, content type, cookies, expected status) per scenario."""
+    app = app_module.app
+    with app.app_context():
+        db = app_module.get_db()
+        admin = db.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+        # one student per grade, so each grade's cached fragments get used
+        students = [r[0] for r in db.execute('SELECT MIN(id) FROM users WHERE is_admin = 0 GROUP BY grade')]
+    admin_cookie = [session_cookie(app, user_id=admin, is_admin=True)]
+    student_cookies = [session_cookie(app, user_id=uid, is_admin=False) for uid in students]
+    multipart = f'multipart/form-data; boundary={BOUNDARY}'
+    return [
+        ('user_dashboard', 'GET', '/user', None, None, student_cookies, 200),
+        ('admin_dashboard', 'GET', '/admin', None, None, admin_cookie, 200),
+        ('admin_preview', 'GET', '/admin/preview', None, None, admin_cookie, 200),
+        ('export_contents_json', 'GET', '/admin/contents/export/json', None, None, admin_cookie, 200),
+        ('export_audit_csv', 'GET', '/admin/export/csv', None, None, admin_cookie, 200),
+        ('import_contents', 'POST', '/admin/contents/import', import_body(seed), multipart, admin_cookie, 302),
+    ]
+
+
+def client_sender(app):
+    client = app.test_client(use_cookies=False)
+
+    def send(method, path, body, content_type, cookie):
+        headers = {'Cookie': cookie}
+        if content_type:
+            headers['Content-Type'] = content_type
+        resp = client.open(path, method=method, data=body, headers=headers)
+        resp.get_data()
+        resp.close()
+        return resp.status_code
+
+    return send
+
+
+def server_sender(host, port):
+    def send(method, path, body, content_type, cookie):
+        headers = {'Cookie': cookie}
+        if content_type:
+            headers['Content-Type'] = content_type
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+        try:
+            conn.request(method, path, body, headers)
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        finally:
+            conn.close()
+
+    return send
+
+
+def run_scenario(make_sender, scenario, requests, concurrency, warmup):
+    name, method, path, body, content_type, cookies, expected = scenario
+    send = make_sender()
+    for i in range(warmup):
+        send(method, path, body, content_type, cookies[i % len(cookies)])
+
+    counter = itertools.count()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        send = make_sender()
+        mine, failed = [], 0
+        while True:
+            i = next(counter)
+            if i >= requests:
+                break
+            start = time.perf_counter()
+            try:
+                status = send(method, path, body, content_type, cookies[i % len(cookies)])
+            except Exception:
+                status = None
+            mine.append(time.perf_counter() - start)
+            failed += status != expected
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'scenario': name, 'method': method, 'path': path, 'requests': len(latencies), 'errors': sum(errors),
+        'concurrency': concurrency, 'seconds': round(wall, 4),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+    }
+
+
+def serve(app):
+    from werkzeug.serving import make_server
+    # one access log line per request would be measured too
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return server
+
+
+def compare(report, baseline):
+    """Lines comparing report with an earlier one, per mode and scenario."""
+    before = {(r['mode'], r['scenario']): r for r in baseline['results']}
+    lines = [f"vs {baseline.get('commit') or 'baseline'}:"]
+    for r in report['results']:
+        old = before.get((r['mode'], r['scenario']))
+        if not old:
+            continue
+        changes = []
+        for key in ('throughput_rps', 'p50_ms', 'p99_ms'):
+            if old[key]:
+                changes.append(f'{key} {(r[key] / old[key] - 1) * 100:+.1f}%')
+        lines.append(f"  {r['mode']:6} {r['scenario']:22} " + '  '.join(changes))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=('client', 'server', 'both'), default='both')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--contents', type=int, default=2000)
+    parser.add_argument('--audit', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenario', action='append', help='only run these scenarios (repeatable)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='earlier JSON report to compare against')
+    args = parser.parse_args()
+    # datagen.prepare() changes directory
+    output = args.output and os.path.abspath(args.output)
+    baseline = args.baseline and os.path.abspath(args.baseline)
+
+    started = time.perf_counter()
+    app_module = datagen.prepare(None, args.users, args.contents, args.audit, args.seed)
+    app_module.app.config['WTF_CSRF_ENABLED'] = False
+    print(f'data generated in {time.perf_counter() - started:.1f}s in {os.getcwd()}', file=sys.stderr)
+    chosen = [s for s in scenarios(app_module, args.seed) if not args.scenario or s[0] in args.scenario]
+
+    modes = ['client', 'server'] if args.mode == 'both' else [args.mode]
+    results = []
+    for mode in modes:
+        server = None
+        if mode == 'client':
+            def make_sender():
+                return client_sender(app_module.app)
+        else:
+            server = serve(app_module.app)
+
+            def make_sender():
+                return server_sender('127.0.0.1', server.server_port)
+        try:
+            for scenario in chosen:
+                result = dict(mode=mode, **run_scenario(make_sender, scenario, args.requests,
+                                                         args.concurrency, args.warmup))
+                results.append(result)
+                print(f"{mode:6} {result['scenario']:22} {result['throughput_rps']:9.1f} req/s  "
+                      f"p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+                      f"errors {result['errors']}", file=sys.stderr)
+        finally:
+            if server:
+                server.shutdown()
+
+    report = {
+        'commit': commit(), 'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+        'params': {k: getattr(args, k) for k in ('requests', 'concurrency', 'warmup', 'users', 'contents',
+                                                 'audit', 'seed')},
+        'peak_rss_kib': peak_rss_kib(), 'results': results,
+    }
+    app_module.render_job.stop()
+    app_module.audit_writer.close()
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if baseline:
+        with open(baseline) as f:
+            print('\n'.join(compare(report, json.load(f))), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+content_grades / content_categories maintenance.
+
+The CSV columns on contents stay the source of truth; these helpers keep the
+indexed junction tables in step with them, and the facet counts with both.
+"""
+
+import facets
+
+
+def split_csv(value):
+    if not value:
+        return []
+    return [x.strip() for x in str(value).split(',') if x.strip()]
+
+
+def tag_rows(content_id, grades, categories):
+    """(grade rows, category rows) for one content, ready for executemany()."""
+    return ([(content_id, g) for g in split_csv(grades)],
+            [(content_id, c) for c in split_csv(categories)])
+
+
+def insert_tags(db, grade_rows, category_rows):
+    db.executemany('INSERT OR IGNORE INTO content_grades (content_id,grade) VALUES (?,?)', grade_rows)
+    db.executemany('INSERT OR IGNORE INTO content_categories (content_id,category) VALUES (?,?)', category_rows)
+
+
+def add_tags(db, content_ids, grade_rows, category_rows):
+    """insert_tags() for new contents, also counting them in the facets."""
+    insert_tags(db, grade_rows, category_rows)
+    facets.adjust(db, content_ids, grade_rows, category_rows)
+
+
+def sync_content_tags(db, content_id, grades, categories, new=False):
+    # new: the content was just inserted, so it has nothing to uncount
+    if not new:
+        old_grades = db.execute('SELECT content_id, grade FROM content_grades WHERE content_id=?',
+                                (content_id,)).fetchall()
+        old_categories = db.execute('SELECT content_id, category FROM content_categories WHERE content_id=?',
+                                    (content_id,)).fetchall()
+        facets.adjust(db, [content_id], [tuple(r) for r in old_grades], [tuple(r) for r in old_categories], -1)
+    db.execute('DELETE FROM content_grades WHERE content_id=?', (content_id,))
+    db.execute('DELETE FROM content_categories WHERE content_id=?', (content_id,))
+    add_tags(db, [content_id], *tag_rows(content_id, grades, categories))
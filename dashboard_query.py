@@ -0,0 +1,73 @@
+"""
+SQL query builder for the admin dashboard lists.
+
+Filters are composed into one parameterized statement so that LIMIT/OFFSET
+apply after filtering and a matching COUNT(*) gives the real total.
+"""
+
+
+class Query:
+    def __init__(self, table, columns='*'):
+        self.table = table
+        self.columns = columns
+        self.joins = []
+        self.where = []
+        self.args = []
+
+    def join(self, clause):
+        self.joins.append(clause)
+        return self
+
+    def filter(self, clause, *args):
+        self.where.append(clause)
+        self.args.extend(args)
+        return self
+
+    def _body(self):
+        sql = f' FROM {self.table}'
+        if self.joins:
+            sql += ' ' + ' '.join(self.joins)
+        if self.where:
+            sql += ' WHERE ' + ' AND '.join(f'({w})' for w in self.where)
+        return sql
+
+    def select(self, order_by=None, limit=None, offset=None):
+        sql = f'SELECT {self.columns}' + self._body()
+        args = list(self.args)
+        if order_by:
+            sql += f' ORDER BY {order_by}'
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            args += [limit, offset or 0]
+        return sql, args
+
+    def count(self):
+        return 'SELECT COUNT(*)' + self._body(), list(self.args)
+
+
+def users_query():
+    return Query('users', 'users.*')
+
+
+def contents_query(grade=None, category=None, author=None, starred=None):
+    # free-text search is added by search.filter_contents()
+    query = Query('contents c', 'c.*, u.username AS author_name, u.starred AS author_starred')
+    query.join('LEFT JOIN users u ON u.id = c.author_id')
+    # contents without grades/categories are not excluded by those filters
+    if grade:
+        query.filter('''c.id IN (
+            SELECT content_id FROM content_grades WHERE grade=?
+            UNION ALL
+            SELECT id FROM contents WHERE grades IS NULL OR grades = ''
+        )''', str(grade))
+    if category:
+        query.filter('''c.id IN (
+            SELECT content_id FROM content_categories WHERE category=?
+            UNION ALL
+            SELECT id FROM contents WHERE categories IS NULL OR categories = ''
+        )''', category.strip())
+    if author:
+        query.filter('c.author_id = ?', author)
+    if starred == '1':
+        query.filter('u.starred = 1')
+    return query
@@ -0,0 +1,102 @@
+"""
+Thread-local SQLite connection pool.
+
+Every thread gets one long-lived connection per database, configured once
+for concurrent use (WAL journal, synchronous=NORMAL, busy_timeout, mmap and
+page cache). Requests borrow the calling thread's connection and hand it back
+at teardown instead of reconnecting each time.
+"""
+
+import os
+import sqlite3
+import threading
+
+
+class ConnectionPool:
+    def __init__(self, path, busy_timeout_ms=5000, cache_size_kib=16384,
+                 mmap_size=256 * 1024 * 1024, statement_cache=256, on_connect=None,
+                 factory=sqlite3.Connection):
+        self.path = path
+        # called with each new connection, e.g. to register SQL functions
+        self.on_connect = on_connect
+        # connection class, e.g. one that times its queries
+        self.factory = factory
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        # sqlite3 keeps an LRU of prepared statements per connection; since
+        # connections are now long-lived that cache survives across requests
+        self.statement_cache = statement_cache
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._local = threading.local()
+        self._connections = {}
+        self._pid = os.getpid()
+        self._stats = {'opened': 0, 'closed': 0, 'checkouts': 0, 'reused': 0, 'rollbacks': 0}
+
+    def _open(self):
+        # check_same_thread=False only so close_all()/_prune() may close
+        # connections of other threads; each is still used by one thread
+        db = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                             cached_statements=self.statement_cache, check_same_thread=False,
+                             factory=self.factory)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        db.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        db.execute(f'PRAGMA cache_size=-{int(self.cache_size_kib)}')
+        if self.on_connect:
+            self.on_connect(db)
+        with self._lock:
+            self._prune()
+            self._connections[threading.get_ident()] = db
+            self._stats['opened'] += 1
+        return db
+
+    def _prune(self):
+        # close connections whose thread has exited (e.g. per-request threads)
+        alive = {t.ident for t in threading.enumerate()}
+        for ident in [i for i in self._connections if i not in alive]:
+            self._connections.pop(ident).close()
+            self._stats['closed'] += 1
+
+    def connection(self):
+        """Return the calling thread's connection, opening it on first use."""
+        if os.getpid() != self._pid:
+            # never share connections across fork(); the child starts fresh
+            with self._lock:
+                self._reset()
+        db = getattr(self._local, 'db', None)
+        with self._lock:
+            self._stats['checkouts'] += 1
+            if db is not None:
+                self._stats['reused'] += 1
+        if db is None:
+            db = self._local.db = self._open()
+        return db
+
+    def release(self, db):
+        """Hand a connection back; anything left uncommitted is rolled back."""
+        if db.in_transaction:
+            db.rollback()
+            with self._lock:
+                self._stats['rollbacks'] += 1
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, {}
+            self._stats['closed'] += len(connections)
+        for db in connections.values():
+            db.close()
+        self._local = threading.local()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['open'] = len(self._connections)
+        out['hit_ratio'] = round(out['reused'] / out['checkouts'], 4) if out['checkouts'] else 0.0
+        out['pid'] = self._pid
+        return out
@@ -0,0 +1,77 @@
+"""
+Streaming exporters.
+
+Rows are pulled from the cursor in fetchmany() batches and encoded one batch
+at a time, so memory use stays flat however large the table is. Wrap the
+result in a Response (with stream_with_context) to send it chunked.
+"""
+
+import csv
+import io
+import itertools
+import json
+import zlib
+
+BATCH_SIZE = 500
+
+
+def iter_rows(cursor, batch_size=BATCH_SIZE):
+    # a DB cursor, or any iterable of rows (e.g. audit_archive.iter_entries)
+    if not hasattr(cursor, 'fetchmany'):
+        rows = iter(cursor)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            yield batch
+        return
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+    cursor.close()
+
+
+def json_array(cursor, batch_size=BATCH_SIZE):
+    yield '['
+    first = True
+    for rows in iter_rows(cursor, batch_size):
+        chunk = ','.join(json.dumps(dict(r), ensure_ascii=False) for r in rows)
+        yield chunk if first else ',' + chunk
+        first = False
+    yield ']'
+
+
+def ndjson(cursor, batch_size=BATCH_SIZE):
+    for rows in iter_rows(cursor, batch_size):
+        yield ''.join(json.dumps(dict(r), ensure_ascii=False) + '\n' for r in rows)
+
+
+def csv_rows(cursor, fields, batch_size=BATCH_SIZE):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    for rows in iter_rows(cursor, batch_size):
+        writer.writerows([r[f] for f in fields] for r in rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def gzipped(chunks, level=6):
+    # wbits=31 produces a gzip container rather than a raw zlib stream
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = z.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield z.flush()
+
+
+def encode(chunks, gzip=False):
+    if gzip:
+        return gzipped(chunks)
+    return (c.encode('utf-8') for c in chunks)
@@ -0,0 +1,57 @@
+"""
+Precomputed sidebar facets.
+
+grade_facets holds, per grade, the number of users in it and the number of
+contents tagged for it. Untagged contents (visible to every grade) are
+counted under grade ''. category_facets holds content counts per
+(grade, category) on the same terms. User counts are kept by triggers on
+users (migrations.py). Content counts are adjusted by content_tags whenever
+tag rows change. Sidebars and dropdowns then read a few rows instead of
+scanning users or contents.
+"""
+
+from collections import Counter
+
+UNGRADED = ''
+
+
+def _counts(content_ids, grade_rows, category_rows):
+    grades = {}
+    for cid, grade in grade_rows:
+        grades.setdefault(cid, set()).add(str(grade))
+    per_grade = Counter()
+    per_category = Counter()
+    for cid in set(content_ids):
+        for grade in grades.get(cid) or (UNGRADED,):
+            per_grade[grade] += 1
+    for cid, category in set(category_rows):
+        for grade in grades.get(cid) or (UNGRADED,):
+            per_category[(grade, category)] += 1
+    return per_grade, per_category
+
+
+def adjust(db, content_ids, grade_rows, category_rows, sign=1):
+    """Add (sign=1) or remove (sign=-1) these contents' tag rows from the facet counts."""
+    per_grade, per_category = _counts(content_ids, grade_rows, category_rows)
+    db.executemany('''INSERT INTO grade_facets (grade, contents) VALUES (?, ?)
+                      ON CONFLICT(grade) DO UPDATE SET contents = contents + excluded.contents''',
+                   [(g, sign * n) for g, n in per_grade.items()])
+    db.executemany('''INSERT INTO category_facets (grade, category, contents) VALUES (?, ?, ?)
+                      ON CONFLICT(grade, category) DO UPDATE SET contents = contents + excluded.contents''',
+                   [(g, c, sign * n) for (g, c), n in per_category.items()])
+    if sign < 0:
+        db.execute('DELETE FROM category_facets WHERE contents <= 0')
+        db.execute('DELETE FROM grade_facets WHERE contents <= 0 AND users <= 0')
+
+
+def user_grades(db):
+    """Rows with a `grade` column for every grade that has users, in order."""
+    return db.execute('''SELECT CAST(grade AS INTEGER) AS grade, users FROM grade_facets
+                         WHERE users > 0 ORDER BY CAST(grade AS INTEGER)''').fetchall()
+
+
+def visible_categories(db, grade):
+    """(category, contents) rows visible to a grade: its own plus the untagged."""
+    return db.execute('''SELECT category, SUM(contents) AS contents FROM category_facets
+                         WHERE grade IN (?, ?) GROUP BY category ORDER BY category''',
+                      (str(grade), UNGRADED)).fetchall()
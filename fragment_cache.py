@@ -0,0 +1,70 @@
+"""
+In-process cache of rendered HTML fragments.
+
+Entries are stamped with the generation they were rendered at; a lookup
+with a newer generation is a miss and drops the stale entry. Eviction is
+LRU under both an entry count and a byte budget.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    def __init__(self, max_bytes=8 * 1024 * 1024, max_entries=256):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+
+    @staticmethod
+    def _size(value):
+        return sum(len(v) for v in value) if isinstance(value, tuple) else len(value)
+
+    def _drop(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= self._size(value)
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if entry[0] != generation:
+                self._drop(key)
+                self._stats['misses'] += 1
+                self._stats['stale'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, generation, value):
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (generation, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['entries'] = len(self._entries)
+            out['bytes'] = self._bytes
+        lookups = out['hits'] + out['misses']
+        out['hit_ratio'] = round(out['hits'] / lookups, 4) if lookups else 0.0
+        return out
@@ -0,0 +1,57 @@
+"""
+Conditional GET helpers.
+
+Views compute a cheap validator (an ETag built from generation counters,
+and optionally a Last-Modified time) before doing any real work, and return
+not_modified() early when the client's copy is still current.
+"""
+
+import hashlib
+import re
+from datetime import datetime, timezone
+
+from flask import current_app, request, session
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+_ETAG_SAFE = re.compile(r'[A-Za-z0-9_.:-]*')
+
+
+def parse_db_time(value):
+    # CURRENT_TIMESTAMP values are UTC 'YYYY-MM-DD HH:MM:SS'
+    if not value:
+        return None
+    return datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+
+def make_etag(*parts):
+    etag = '-'.join(str(p) for p in parts)
+    # free-form parts (search terms, query args) must not reach the header as-is
+    if not _ETAG_SAFE.fullmatch(etag):
+        etag = hashlib.sha1(etag.encode('utf-8')).hexdigest()
+    return etag
+
+
+def is_fresh(etag, last_modified=None):
+    """True if the request's If-None-Match / If-Modified-Since match."""
+    if session.get('_flashes'):
+        # the page would show pending flash messages
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def not_modified(etag, last_modified=None, private=True):
+    return set_validators(current_app.response_class(status=304), etag, last_modified, private)
+
+
+def set_validators(resp, etag, last_modified=None, private=True):
+    resp.set_etag(etag, weak=True)
+    if last_modified:
+        resp.last_modified = last_modified
+    # cached copies must be revalidated; private ones are per session
+    resp.headers['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+    resp.vary.add('Cookie')
+    return resp
@@ -0,0 +1,135 @@
+"""
+Responsive image variants for uploads.
+
+A small in-process thread pool resizes each new upload to a few widths and
+saves them as WebP next to the original; rewrite_srcset() then points <img>
+tags at them. Pillow is optional: without it no variants are made and images
+are served as uploaded.
+"""
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+WIDTHS = (320, 640, 1024)
+SIZES = '(max-width: 768px) 100vw, 768px'
+WEBP_QUALITY = 80
+
+_IMG_RE = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+_SRC_RE = re.compile(r'\ssrc="/static/uploads/([^"/]+)"')
+
+
+def available():
+    return Image is not None
+
+
+def variant_name(filename, width):
+    return f'{filename.rsplit(".", 1)[0]}-{width}w.webp'
+
+
+def generate(db, folder, upload):
+    """Write the variants for one uploads row and record them."""
+    src = os.path.join(folder, upload['filename'])
+    with Image.open(src) as im:
+        width, height = im.size
+        rows = []
+        # animated GIFs would lose their animation; leave them alone
+        if not getattr(im, 'is_animated', False):
+            im = im.convert('RGBA' if im.mode in ('RGBA', 'LA', 'P') else 'RGB')
+            for w in WIDTHS:
+                if w >= width:
+                    break
+                h = max(1, round(height * w / width))
+                name = variant_name(upload['filename'], w)
+                im.resize((w, h), Image.LANCZOS).save(os.path.join(folder, name), 'WEBP', quality=WEBP_QUALITY)
+                rows.append((upload['sha256'], w, h, name))
+    db.executemany('INSERT OR REPLACE INTO upload_variants (sha256, width, height, filename) VALUES (?,?,?,?)', rows)
+    db.execute('UPDATE uploads SET width=?, height=? WHERE sha256=?', (width, height, upload['sha256']))
+    return rows
+
+
+class VariantQueue:
+    """
+    Background generation; connect() must return a connection usable on the
+    worker thread. on_done(db, upload) runs before each commit.
+    """
+
+    def __init__(self, connect, folder, on_done=None, workers=2):
+        self.connect = connect
+        self.folder = folder
+        self.on_done = on_done
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def enqueue(self, sha256):
+        if not available():
+            return None
+        with self._lock:
+            if sha256 in self._pending:
+                return None
+            self._pending.add(sha256)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='image-variants')
+            return self._executor.submit(self._run, sha256)
+
+    def enqueue_missing(self, db):
+        for row in db.execute('SELECT sha256 FROM uploads WHERE width IS NULL').fetchall():
+            self.enqueue(row['sha256'])
+
+    def _run(self, sha256):
+        try:
+            db = self.connect()
+            upload = db.execute('SELECT * FROM uploads WHERE sha256=?', (sha256,)).fetchone()
+            if upload is None or upload['width'] is not None:
+                return
+            try:
+                generate(db, self.folder, upload)
+            except (OSError, ValueError):
+                # unreadable image: mark it done so it is not retried forever
+                db.execute('UPDATE uploads SET width=0, height=0 WHERE sha256=?', (sha256,))
+            if self.on_done:
+                self.on_done(db, upload)
+            db.commit()
+        finally:
+            with self._lock:
+                self._pending.discard(sha256)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+
+def rewrite_srcset(html, db):
+    """Add srcset/sizes to <img> tags that point at uploads with variants."""
+    if not html or '/static/uploads/' not in html:
+        return html
+    names = set(_SRC_RE.findall(html))
+    if not names:
+        return html
+    marks = ','.join('?' * len(names))
+    variants = {}
+    for r in db.execute(f'''SELECT u.filename AS src, u.width AS src_width, v.filename, v.width
+                            FROM upload_variants v JOIN uploads u ON u.sha256 = v.sha256
+                            WHERE u.filename IN ({marks}) ORDER BY v.width''', list(names)):
+        variants.setdefault(r['src'], [f'/static/uploads/{r["src"]} {r["src_width"]}w'])
+        variants[r['src']].insert(-1, f'/static/uploads/{r["filename"]} {r["width"]}w')
+
+    def add(match):
+        tag = match.group(0)
+        src = _SRC_RE.search(tag)
+        if not src or src.group(1) not in variants or ' srcset=' in tag:
+            return tag
+        attrs = f' srcset="{", ".join(variants[src.group(1)])}" sizes="{SIZES}"'
+        return tag[:-2] + attrs + '/>' if tag.endswith('/>') else tag[:-1] + attrs + '>'
+
+    return _IMG_RE.sub(add, html)
@@ -0,0 +1,175 @@
+"""
+Bulk content import.
+
+Reads a JSON array, a single JSON object or NDJSON incrementally, and
+imports it in batches: one set-based duplicate check per batch, HTML
+sanitized in batches (in a process pool), rows inserted with executemany(), and the
+whole import committed as a single transaction.
+"""
+
+import codecs
+import json
+
+import content_tags
+
+BATCH_SIZE = 500
+READ_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.fileobj.read(READ_SIZE)
+        if not chunk:
+            self.eof = True
+        text = self.decoder.decode(chunk or b'', final=self.eof)
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+
+    def peek(self):
+        """Next non-whitespace character ('' at end of input)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._fill()
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            if end == len(self.buf) and not self.eof:
+                # a number or literal may continue in the next chunk
+                self._fill()
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_items(fileobj):
+    """Yield the top-level items of a JSON array, a JSON object or NDJSON."""
+    reader = _Reader(fileobj)
+    if reader.peek() == '[':
+        reader.pos += 1
+        if reader.peek() == ']':
+            return
+        while True:
+            yield reader.value()
+            c = reader.peek()
+            if c == ']':
+                return
+            if c != ',':
+                raise ValueError('expected "," or "]" in JSON array')
+            reader.pos += 1
+    while reader.peek():
+        yield reader.value()
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ','.join(str(v) for v in value)
+    return str(value)
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+
+    @property
+    def processed(self):
+        return self.imported + self.skipped + len(self.errors)
+
+
+def _item_id(item):
+    try:
+        return int(item.get('id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _import_batch(db, batch, author_id, sanitize_many, report):
+    # batch is a list of (index in file, item)
+    ids = [i for i in (_item_id(item) for _, item in batch) if i is not None]
+    existing = set()
+    for i in range(0, len(ids), 900):
+        chunk = ids[i:i + 900]
+        marks = ','.join('?' * len(chunk))
+        existing.update(r[0] for r in db.execute(f'SELECT id FROM contents WHERE id IN ({marks})', chunk))
+    fresh = []
+    for _, item in batch:
+        if _item_id(item) in existing:
+            report.skipped += 1
+        else:
+            fresh.append(item)
+    if not fresh:
+        return
+    safe = sanitize_many([_text(item.get('html')) for item in fresh])
+    # we hold the write lock, so ids can be assigned up front for the tag rows
+    next_id = db.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name='contents'").fetchone()[0]
+    next_id = max(next_id, db.execute('SELECT COALESCE(MAX(id), 0) FROM contents').fetchone()[0]) + 1
+    rows, grade_rows, category_rows = [], [], []
+    for offset, (item, html) in enumerate(zip(fresh, safe)):
+        cid = next_id + offset
+        grades, categories = _text(item.get('grades')), _text(item.get('categories'))
+        rows.append((cid, _text(item.get('title')), html, _text(item.get('link')), categories, grades, author_id))
+        g, c = content_tags.tag_rows(cid, grades, categories)
+        grade_rows += g
+        category_rows += c
+    db.executemany('INSERT INTO contents (id,title,html,link,categories,grades,author_id) VALUES (?,?,?,?,?,?,?)', rows)
+    content_tags.add_tags(db, [r[0] for r in rows], grade_rows, category_rows)
+    report.imported += len(rows)
+
+
+def import_contents(db, fileobj, author_id, sanitize_many, batch_size=BATCH_SIZE, progress=None):
+    """
+    Import every item of fileobj as contents by author_id.
+
+    sanitize_many maps a list of HTML bodies to their stored form (see
+    sanitizer.sanitize_many).
+    Items whose id already exists are skipped, items that are not objects
+    are recorded in report.errors as (position, message). progress, if
+    given, is called with the report after each batch. Nothing is written
+    unless the whole file parses.
+    """
+    report = ImportReport()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        batch = []
+        for index, item in enumerate(iter_items(fileobj)):
+            if not isinstance(item, dict):
+                report.errors.append((index, 'item is not an object'))
+                continue
+            batch.append((index, item))
+            if len(batch) >= batch_size:
+                _import_batch(db, batch, author_id, sanitize_many, report)
+                batch = []
+                if progress:
+                    progress(report)
+        if batch:
+            _import_batch(db, batch, author_id, sanitize_many, report)
+            if progress:
+                progress(report)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return report
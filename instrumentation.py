@@ -0,0 +1,155 @@
+"""
+Request and SQL instrumentation.
+
+Connections made with the Connection class below time every execute() and
+executemany() and charge it to the request running on that thread. At the
+end of a request its latency goes into a per-route histogram and its
+query count and time into per-route totals. Statements slower than
+slow_ms are logged together with their EXPLAIN QUERY PLAN. Figures are
+per process; render() formats them as Prometheus text.
+
+Only the time spent executing a statement (up to its first row) is
+counted; rows fetched later are not.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# seconds; Prometheus-style cumulative buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOW_MS = 100
+SLOW_LOG_SIZE = 100
+
+_local = threading.local()
+
+
+class Cursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            recorder.query(self.connection, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            recorder.query(self.connection, sql, None, time.perf_counter() - start)
+
+
+class Connection(sqlite3.Connection):
+    """Pass as factory= to sqlite3.connect."""
+
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+    # the C shortcuts would bypass cursor(), so route them through it
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Recorder:
+    def __init__(self, slow_ms=SLOW_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._queries = {}
+        self.slow = deque(maxlen=SLOW_LOG_SIZE)
+        self.slow_total = 0
+
+    def start(self):
+        _local.request = {'start': time.perf_counter(), 'queries': 0, 'db': 0.0}
+
+    def current(self):
+        return getattr(_local, 'request', None)
+
+    def query(self, db, sql, parameters, elapsed):
+        req = self.current()
+        if req is not None:
+            req['queries'] += 1
+            req['db'] += elapsed
+        if elapsed * 1000 >= self.slow_ms and parameters is not None and not sql.lstrip().upper().startswith(
+                ('EXPLAIN', 'PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK')):
+            self._slow(db, sql, parameters, elapsed)
+
+    def _slow(self, db, sql, parameters, elapsed):
+        try:
+            # a plain cursor, so the EXPLAIN is not timed or explained itself
+            plan = [row[3] for row in sqlite3.Cursor(db).execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+        except sqlite3.Error as e:
+            plan = [f'(no plan: {e})']
+        entry = {'ms': round(elapsed * 1000, 2), 'sql': ' '.join(sql.split()), 'plan': plan,
+                 'at': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with self._lock:
+            self.slow.append(entry)
+            self.slow_total += 1
+        log.warning('slow query (%.1f ms): %s | plan: %s', entry['ms'], entry['sql'], '; '.join(plan))
+
+    def finish(self, route):
+        """Record the current request; returns (seconds, queries, db seconds) or None."""
+        req = getattr(_local, 'request', None)
+        _local.request = None
+        if req is None:
+            return None
+        elapsed = time.perf_counter() - req['start']
+        with self._lock:
+            self._routes.setdefault(route, _Histogram()).observe(elapsed)
+            totals = self._queries.setdefault(route, [0, 0.0])
+            totals[0] += req['queries']
+            totals[1] += req['db']
+        return elapsed, req['queries'], req['db']
+
+    def render(self, stats=None):
+        """Prometheus text; stats maps a component name to its stats() dict, exported as gauges."""
+        lines = ['# TYPE http_request_duration_seconds histogram']
+        with self._lock:
+            routes = sorted(self._routes.items())
+            queries = sorted(self._queries.items())
+            slow_total = self.slow_total
+        for route, h in routes:
+            for bound, count in zip(BUCKETS, h.counts):
+                lines.append(f'http_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {count}')
+            lines.append(f'http_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {h.count}')
+            lines.append(f'http_request_duration_seconds_sum{{route="{route}"}} {h.sum:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{route="{route}"}} {h.count}')
+        lines.append('# TYPE db_queries_total counter')
+        lines += [f'db_queries_total{{route="{route}"}} {n}' for route, (n, _) in queries]
+        lines.append('# TYPE db_query_seconds_total counter')
+        lines += [f'db_query_seconds_total{{route="{route}"}} {s:.6f}' for route, (_, s) in queries]
+        lines.append('# TYPE db_slow_queries_total counter')
+        lines.append(f'db_slow_queries_total {slow_total}')
+        for component, values in sorted((stats or {}).items()):
+            for key, value in sorted(values.items()):
+                # numbers only; pid is an identifier, not a measurement
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or key == 'pid':
+                    continue
+                lines.append(f'# TYPE app_{component}_{key} gauge')
+                lines.append(f'app_{component}_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+recorder = Recorder()
@@ -0,0 +1,378 @@
+"""
+Versioned schema migrations for data.db.
+
+Each migration runs once, inside its own transaction, and is recorded in the
+schema_version table. Run them at startup (see bootstrap() in app.py or
+`flask --app app init-db`), never from request handling.
+"""
+
+import logging
+import sqlite3
+
+import content_tags
+
+log = logging.getLogger(__name__)
+
+
+def _run(db, script):
+    # execute a multi-statement script inside the current transaction
+    # (executescript() would COMMIT first)
+    stmt = ''
+    for line in script.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            db.execute(stmt)
+            stmt = ''
+    if stmt.strip():
+        db.execute(stmt)
+
+
+def _columns(db, table):
+    return [r[1] for r in db.execute(f'PRAGMA table_info({table})')]
+
+
+def _base_schema(db):
+    _run(db, '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        grade INTEGER DEFAULT 0,
+        is_admin INTEGER DEFAULT 0,
+        starred INTEGER DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS contents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        html TEXT,
+        link TEXT,
+        categories TEXT,
+        grades TEXT,
+        author_id INTEGER,
+        FOREIGN KEY(author_id) REFERENCES users(id)
+    );
+    CREATE TABLE IF NOT EXISTS audit_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+        user_id INTEGER,
+        action TEXT
+    );
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    ''')
+
+
+def _user_role(db):
+    # databases created before versioning may already have it
+    if 'role' not in _columns(db, 'users'):
+        db.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'user'")
+
+
+def _content_tags(db):
+    _run(db, '''
+    CREATE TABLE IF NOT EXISTS content_grades (
+        content_id INTEGER NOT NULL,
+        grade TEXT NOT NULL,
+        PRIMARY KEY (content_id, grade),
+        FOREIGN KEY(content_id) REFERENCES contents(id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_content_grades_grade ON content_grades(grade, content_id);
+    CREATE TABLE IF NOT EXISTS content_categories (
+        content_id INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        PRIMARY KEY (content_id, category),
+        FOREIGN KEY(content_id) REFERENCES contents(id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_content_categories_category ON content_categories(category, content_id);
+    CREATE INDEX IF NOT EXISTS idx_contents_ungraded ON contents(id) WHERE grades IS NULL OR grades = '';
+    ''')
+    # backfill from the CSV columns
+    db.execute('DELETE FROM content_grades')
+    db.execute('DELETE FROM content_categories')
+    grades = []
+    categories = []
+    for cid, g, cats in db.execute('SELECT id, grades, categories FROM contents').fetchall():
+        g_rows, c_rows = content_tags.tag_rows(cid, g, cats)
+        grades += g_rows
+        categories += c_rows
+    content_tags.insert_tags(db, grades, categories)
+
+
+def _audit_ts_index(db):
+    db.execute('CREATE INDEX IF NOT EXISTS idx_audit_logs_ts_id ON audit_logs(ts, id)')
+
+
+def _generations(db):
+    _run(db, '''
+    CREATE TABLE IF NOT EXISTS generations (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO generations (name, value) VALUES ('contents', 0), ('users', 0);
+    ''')
+
+
+def _updated_at(db):
+    for table in ('contents', 'users'):
+        if 'updated_at' not in _columns(db, table):
+            # ALTER TABLE cannot add a CURRENT_TIMESTAMP default; triggers fill it in
+            db.execute(f'ALTER TABLE {table} ADD COLUMN updated_at DATETIME')
+        _run(db, f'''
+        UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table}(updated_at);
+        CREATE TRIGGER IF NOT EXISTS {table}_touch_insert AFTER INSERT ON {table}
+        WHEN NEW.updated_at IS NULL
+        BEGIN
+            UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS {table}_touch_update AFTER UPDATE ON {table}
+        WHEN NEW.updated_at IS OLD.updated_at
+        BEGIN
+            UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+        END;
+        ''')
+
+
+def _uploads(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS uploads (
+        sha256 TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mime TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+
+def _upload_variants(db):
+    for column in ('width', 'height'):
+        if column not in _columns(db, 'uploads'):
+            db.execute(f'ALTER TABLE uploads ADD COLUMN {column} INTEGER')
+    db.execute('''CREATE TABLE IF NOT EXISTS upload_variants (
+        sha256 TEXT NOT NULL,
+        width INTEGER NOT NULL,
+        height INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        PRIMARY KEY (sha256, width),
+        FOREIGN KEY(sha256) REFERENCES uploads(sha256)
+    )''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_uploads_filename ON uploads(filename)')
+
+
+def _search(db):
+    # html_text() is registered on app connections by search.register()
+    _run(db, '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS contents_fts USING fts5(
+        title, body, categories,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    );
+    INSERT INTO contents_fts(contents_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0)');
+    DELETE FROM contents_fts;
+    INSERT INTO contents_fts (rowid, title, body, categories)
+        SELECT id, title, html_text(html), categories FROM contents;
+    CREATE TRIGGER IF NOT EXISTS contents_fts_insert AFTER INSERT ON contents BEGIN
+        INSERT INTO contents_fts (rowid, title, body, categories)
+        VALUES (NEW.id, NEW.title, html_text(NEW.html), NEW.categories);
+    END;
+    CREATE TRIGGER IF NOT EXISTS contents_fts_update AFTER UPDATE OF title, html, categories ON contents BEGIN
+        DELETE FROM contents_fts WHERE rowid = OLD.id;
+        INSERT INTO contents_fts (rowid, title, body, categories)
+        VALUES (NEW.id, NEW.title, html_text(NEW.html), NEW.categories);
+    END;
+    CREATE TRIGGER IF NOT EXISTS contents_fts_delete AFTER DELETE ON contents BEGIN
+        DELETE FROM contents_fts WHERE rowid = OLD.id;
+    END;
+
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        username, content = 'users', content_rowid = 'id', tokenize = 'trigram'
+    );
+    INSERT INTO users_fts(users_fts) VALUES ('rebuild');
+    CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts (rowid, username) VALUES (NEW.id, NEW.username);
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', OLD.id, OLD.username);
+        INSERT INTO users_fts (rowid, username) VALUES (NEW.id, NEW.username);
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', OLD.id, OLD.username);
+    END;
+    ''')
+
+
+def _audit_fields(db):
+    cols = _columns(db, 'audit_logs')
+    for name, decl in (('verb', 'TEXT'), ('target_type', 'TEXT'), ('target_id', 'INTEGER')):
+        if name not in cols:
+            db.execute(f'ALTER TABLE audit_logs ADD COLUMN {name} {decl}')
+    # old rows look like "added user:name"; the target was recorded by name only
+    db.execute('''UPDATE audit_logs SET
+        verb = CASE WHEN instr(action, ' ') THEN substr(action, 1, instr(action, ' ') - 1) ELSE action END,
+        target_type = CASE WHEN instr(action, ':') AND instr(action, ' ') < instr(action, ':')
+            THEN substr(action, instr(action, ' ') + 1, instr(action, ':') - instr(action, ' ') - 1) END
+        WHERE verb IS NULL''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_audit_logs_target ON audit_logs(target_type, target_id, ts)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_audit_logs_verb ON audit_logs(verb, ts)')
+
+
+def _audit_archives(db):
+    _run(db, '''
+    CREATE TABLE IF NOT EXISTS audit_archives (
+        filename TEXT PRIMARY KEY,
+        day TEXT NOT NULL,
+        min_id INTEGER NOT NULL,
+        max_id INTEGER NOT NULL,
+        min_ts TEXT NOT NULL,
+        max_ts TEXT NOT NULL,
+        rows INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_audit_archives_ts ON audit_archives(max_ts, min_ts);
+    ''')
+
+
+def _settings_version(db):
+    db.execute("INSERT OR IGNORE INTO generations (name, value) VALUES ('settings', 0)")
+
+
+def _facets(db):
+    _run(db, '''
+    CREATE TABLE IF NOT EXISTS grade_facets (
+        grade TEXT PRIMARY KEY,
+        users INTEGER NOT NULL DEFAULT 0,
+        contents INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS category_facets (
+        grade TEXT NOT NULL,
+        category TEXT NOT NULL,
+        contents INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (grade, category)
+    );
+    DELETE FROM grade_facets;
+    DELETE FROM category_facets;
+    INSERT INTO grade_facets (grade, users)
+        SELECT CAST(grade AS TEXT), COUNT(*) FROM users WHERE grade IS NOT NULL GROUP BY 1;
+    INSERT INTO grade_facets (grade, contents)
+        SELECT COALESCE(g.grade, ''), COUNT(*) FROM contents c LEFT JOIN content_grades g ON g.content_id = c.id
+        WHERE true GROUP BY 1
+        ON CONFLICT(grade) DO UPDATE SET contents = excluded.contents;
+    INSERT INTO category_facets (grade, category, contents)
+        SELECT COALESCE(g.grade, ''), cc.category, COUNT(*) FROM content_categories cc
+        LEFT JOIN content_grades g ON g.content_id = cc.content_id GROUP BY 1, 2;
+
+    CREATE TRIGGER IF NOT EXISTS grade_facets_user_insert AFTER INSERT ON users WHEN NEW.grade IS NOT NULL BEGIN
+        INSERT INTO grade_facets (grade, users) VALUES (CAST(NEW.grade AS TEXT), 1)
+            ON CONFLICT(grade) DO UPDATE SET users = users + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS grade_facets_user_update AFTER UPDATE OF grade ON users
+    WHEN NEW.grade IS NOT OLD.grade BEGIN
+        UPDATE grade_facets SET users = users - 1 WHERE grade = CAST(OLD.grade AS TEXT);
+        INSERT INTO grade_facets (grade, users) SELECT CAST(NEW.grade AS TEXT), 1 WHERE NEW.grade IS NOT NULL
+            ON CONFLICT(grade) DO UPDATE SET users = users + 1;
+        DELETE FROM grade_facets WHERE users <= 0 AND contents <= 0;
+    END;
+    CREATE TRIGGER IF NOT EXISTS grade_facets_user_delete AFTER DELETE ON users BEGIN
+        UPDATE grade_facets SET users = users - 1 WHERE grade = CAST(OLD.grade AS TEXT);
+        DELETE FROM grade_facets WHERE users <= 0 AND contents <= 0;
+    END;
+    ''')
+
+
+def _content_renders(db):
+    # filled in by render.RenderJob after the upgrade
+    _run(db, '''
+    CREATE TABLE IF NOT EXISTS content_renders (
+        content_id INTEGER PRIMARY KEY,
+        version TEXT NOT NULL,
+        body TEXT NOT NULL,
+        excerpt TEXT NOT NULL,
+        card TEXT NOT NULL,
+        rendered_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(content_id) REFERENCES contents(id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_content_renders_version ON content_renders(version);
+    ''')
+
+
+def _generations_changed_at(db):
+    # Last-Modified of the cached pages: moves with every bump, including
+    # re-renders and setting changes that leave updated_at alone
+    if 'changed_at' not in _columns(db, 'generations'):
+        db.execute('ALTER TABLE generations ADD COLUMN changed_at DATETIME')
+    _run(db, '''
+    UPDATE generations SET changed_at = CURRENT_TIMESTAMP WHERE changed_at IS NULL;
+    CREATE TRIGGER IF NOT EXISTS generations_touch AFTER UPDATE OF value ON generations
+    WHEN NEW.changed_at IS OLD.changed_at
+    BEGIN
+        UPDATE generations SET changed_at = CURRENT_TIMESTAMP WHERE name = NEW.name;
+    END;
+    ''')
+
+
+MIGRATIONS = [
+    (1, 'base schema', _base_schema),
+    (2, 'users.role', _user_role),
+    (3, 'content_grades / content_categories', _content_tags),
+    (4, 'audit_logs(ts, id) index', _audit_ts_index),
+    (5, 'generations', _generations),
+    (6, 'contents/users updated_at', _updated_at),
+    (7, 'uploads', _uploads),
+    (8, 'upload_variants', _upload_variants),
+    (9, 'full-text search', _search),
+    (10, 'structured audit fields', _audit_fields),
+    (11, 'audit_archives', _audit_archives),
+    (12, 'settings version', _settings_version),
+    (13, 'grade / category facets', _facets),
+    (14, 'content_renders', _content_renders),
+    (15, 'generations changed_at', _generations_changed_at),
+]
+
+
+def current_version(db):
+    row = db.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def _incremental_vacuum(db):
+    # the audit archiver frees pages with incremental_vacuum, which needs
+    # auto_vacuum=INCREMENTAL; an existing file only switches over with a
+    # full VACUUM (instant on a new file, once-off on an upgraded one)
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return
+    log.info('switching data.db to incremental auto_vacuum (one full VACUUM)')
+    db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    try:
+        db.execute('VACUUM')
+    except sqlite3.OperationalError as e:
+        # e.g. another connection is reading; retried at the next startup
+        log.warning('VACUUM for incremental auto_vacuum skipped: %s', e)
+
+
+def migrate(db):
+    """Apply pending migrations, returns the list of versions applied."""
+    db.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    applied = []
+    _incremental_vacuum(db)
+    if current_version(db) >= MIGRATIONS[-1][0]:
+        return applied
+    for version, description, step in MIGRATIONS:
+        # BEGIN IMMEDIATE so concurrent workers starting up apply each step once
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if current_version(db) >= version:
+                db.rollback()
+                continue
+            step(db)
+            db.execute('INSERT INTO schema_version (version, description) VALUES (?,?)', (version, description))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append(version)
+    return applied
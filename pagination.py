@@ -0,0 +1,104 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by the sort key of the row at their edge, so fetching a
+deep page is an index seek rather than an OFFSET scan. Cursors are opaque
+URL-safe tokens; a bad or tampered token just falls back to the first page.
+"""
+
+import base64
+import json
+
+
+def encode_cursor(values, direction='n'):
+    raw = json.dumps({'k': list(values), 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        values, direction = data['k'], data['d']
+    except (ValueError, KeyError, TypeError):
+        return None
+    if direction not in ('n', 'p') or not isinstance(values, list):
+        return None
+    if not all(v is None or isinstance(v, (str, int, float)) for v in values):
+        return None
+    return values, direction
+
+
+class Page:
+    def __init__(self, rows, next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def keyset_page(db, query, keys, cursor=None, limit=20, descending=True):
+    """
+    One page of a dashboard_query.Query ordered by keys.
+
+    keys is a list of (sql expression, row column) pairs forming a unique
+    sort key, e.g. [('ts', 'ts'), ('id', 'id')].
+    """
+    exprs = [k[0] for k in keys]
+    decoded = decode_cursor(cursor)
+    if decoded and len(decoded[0]) != len(keys):
+        decoded = None
+    backwards = bool(decoded) and decoded[1] == 'p'
+    # walking backwards flips both the comparison and the sort order
+    forward_order = 'DESC' if descending else 'ASC'
+    reverse_order = 'ASC' if descending else 'DESC'
+    order = reverse_order if backwards else forward_order
+    if decoded:
+        op = '<' if descending != backwards else '>'
+        lhs = '(' + ', '.join(exprs) + ')'
+        rhs = '(' + ', '.join('?' for _ in exprs) + ')'
+        query.filter(f'{lhs} {op} {rhs}', *decoded[0])
+    sql, args = query.select(', '.join(f'{e} {order}' for e in exprs), limit + 1)
+    rows = db.execute(sql, args).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return Page(rows)
+
+    def key_of(row):
+        return [row[k[1]] for k in keys]
+
+    if backwards:
+        next_cursor = encode_cursor(key_of(rows[-1]), 'n')
+        prev_cursor = encode_cursor(key_of(rows[0]), 'p') if more else None
+    else:
+        next_cursor = encode_cursor(key_of(rows[-1]), 'n') if more else None
+        prev_cursor = encode_cursor(key_of(rows[0]), 'p') if decoded else None
+    return Page(rows, next_cursor, prev_cursor)
+
+
+def offset_page(db, query, order_by, cursor=None, limit=20):
+    """
+    One page of a Query in an order with no usable key (e.g. search rank).
+
+    Same Page/cursor interface as keyset_page, but the cursor carries an
+    offset, so keep it for result sets that are short in practice.
+    """
+    decoded = decode_cursor(cursor)
+    offset = 0
+    if decoded and len(decoded[0]) == 1 and isinstance(decoded[0][0], int):
+        offset = max(decoded[0][0], 0)
+    rows = db.execute(*query.select(order_by, limit + 1, offset)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor([offset + limit]) if more else None
+    prev_cursor = encode_cursor([max(offset - limit, 0)]) if offset else None
+    return Page(rows, next_cursor, prev_cursor)
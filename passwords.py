@@ -0,0 +1,146 @@
+"""
+Password hashing and login throttling.
+
+The hash method and cost come from the settings table; a stored hash made
+with other parameters is replaced on the next successful login. Checks run
+on a small bounded thread pool (hashlib releases the GIL while it works),
+so a login storm queues at most `max_pending` checks and the rest are
+turned away at once instead of tying up every worker. A token bucket per
+username and per client address limits guessing.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+log = logging.getLogger(__name__)
+
+
+def method_string(method, iterations):
+    """werkzeug method spec, e.g. 'pbkdf2:sha256:600000'."""
+    if method.startswith('pbkdf2') and iterations:
+        return f'{method}:{int(iterations)}'
+    if method == 'scrypt':
+        # spelled out so stored hashes compare equal in needs_rehash()
+        return 'scrypt:32768:8:1'
+    return method
+
+
+def hash_password(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def needs_rehash(pwhash, method):
+    return not pwhash or pwhash.split('$', 1)[0] != method
+
+
+class Busy(Exception):
+    """Too many password checks are already queued."""
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception():
+        log.error('password rehash failed', exc_info=future.exception())
+
+
+class VerifyPool:
+    def __init__(self, workers=2, max_pending=32, timeout=10.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {'verified': 0, 'rejected': 0, 'timeouts': 0, 'rehashed': 0}
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                raise Busy()
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-verify')
+            future = self._executor.submit(fn, *args)
+        # the slot is held until the work is really over, even when the
+        # caller stopped waiting for it
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def verify(self, pwhash, password):
+        """check_password_hash on the pool; raises Busy when the queue is full."""
+        future = self._submit(check_password_hash, pwhash, password)
+        try:
+            result = future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise Busy()
+        with self._lock:
+            self._stats['verified'] += 1
+        return result
+
+    def rehash(self, password, method, save):
+        """
+        Hash password with method on the pool, then call save(pwhash) there.
+
+        Shares the max_pending bound with verify(); raises Busy when full.
+        """
+        def work():
+            save(hash_password(password, method))
+            with self._lock:
+                self._stats['rehashed'] += 1
+
+        future = self._submit(work)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=self._pending, workers=self.workers, max_pending=self.max_pending)
+
+
+class RateLimiter:
+    """Token bucket per key: `burst` attempts at once, refilled at `rate` per second."""
+
+    def __init__(self, rate=0.2, burst=5, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, *keys):
+        """Take a token from every key's bucket; False (taking none) if any is empty."""
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key in keys:
+                tokens, stamp = self._buckets.get(key, (self.burst, now))
+                levels.append(min(self.burst, tokens + (now - stamp) * self.rate))
+            allowed = all(level >= 1 for level in levels)
+            for key, level in zip(keys, levels):
+                self._buckets[key] = (level - 1 if allowed else level, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
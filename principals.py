@@ -0,0 +1,58 @@
+"""
+Cache of signed-in user principals.
+
+A principal is the handful of users columns that authorization and the
+dashboards need. Entries live for `ttl` seconds in a process-wide map, so a
+change made by another worker process shows up within that window; changes
+made in this process call invalidate() and show up at once.
+"""
+
+import threading
+import time
+
+COLUMNS = ('id', 'username', 'grade', 'is_admin', 'role', 'starred')
+
+
+class PrincipalCache:
+    def __init__(self, ttl=30.0, max_entries=4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidations': 0}
+
+    def get(self, db, user_id):
+        """The principal dict for user_id, or None if there is no such user."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._stats['hits'] += 1
+                return entry[1]
+            self._stats['misses'] += 1
+            if entry is not None:
+                self._stats['expired'] += 1
+        row = db.execute(f'SELECT {", ".join(COLUMNS)} FROM users WHERE id=?', (user_id,)).fetchone()
+        principal = dict(row) if row else None
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # expired entries first; if none, start over rather than track LRU
+                for key in [k for k, e in self._entries.items() if e[0] <= now] or list(self._entries):
+                    del self._entries[key]
+            self._entries[user_id] = (now + self.ttl, principal)
+        return principal
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            self._stats['invalidations'] += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,17 @@
+"""
+Process pools for CPU-bound batch work (sanitizing, password hashing).
+
+The app process runs request handlers and background threads (audit
+writer, render job, variant queue) that may hold locks at any moment; a
+forked child would inherit those locks held, with no thread left to
+release them. Pools therefore start their workers with forkserver, or
+spawn where that is unavailable (Windows).
+"""
+
+import multiprocessing
+
+
+def mp_context():
+    """Context to pass as mp_context= to ProcessPoolExecutor."""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
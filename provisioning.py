@@ -0,0 +1,148 @@
+"""
+Bulk user provisioning from CSV.
+
+The CSV has username and grade columns (a header row is optional). Each
+new user gets a generated password. Password hashes are computed in a
+process pool, since each one is deliberately slow, and rows are inserted
+with executemany inside one transaction. The result lists every input row
+with its status; created rows include the generated password.
+"""
+
+import csv
+import io
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import passwords
+import process_pool
+
+BATCH_SIZE = 500
+POOL_THRESHOLD = 8
+CREDENTIAL_FIELDS = ['username', 'grade', 'password', 'status']
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _hash(args):
+    password, method = args
+    return passwords.hash_password(password, method)
+
+
+def hash_many(plain, method):
+    """Hash a list of passwords, in a process pool when it is large."""
+    global _pool
+    if len(plain) < POOL_THRESHOLD or (os.cpu_count() or 1) < 2:
+        return [_hash((p, method)) for p in plain]
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=process_pool.mp_context())
+    return list(_pool.map(_hash, [(p, method) for p in plain], chunksize=8))
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def generate_password(length):
+    return secrets.token_urlsafe(length)[:length]
+
+
+def iter_rows(fileobj):
+    """(username, grade) per CSV row of a binary or text file; grade is None when invalid."""
+    text = fileobj
+    if 'b' in getattr(fileobj, 'mode', 'b'):
+        text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    for i, row in enumerate(csv.reader(text)):
+        if not row or not row[0].strip():
+            continue
+        username = row[0].strip()
+        grade = row[1].strip() if len(row) > 1 else ''
+        if i == 0 and username.lower() == 'username':
+            continue
+        if not grade:
+            yield username, 0
+        elif grade.isdigit():
+            yield username, int(grade)
+        else:
+            yield username, None
+
+
+class ProvisionReport:
+    def __init__(self):
+        self.rows = []
+        self.created = 0
+
+    @property
+    def skipped(self):
+        return len(self.rows) - self.created
+
+
+def _existing(db, names):
+    marks = ','.join('?' * len(names))
+    return {r[0] for r in db.execute(f'SELECT username FROM users WHERE username IN ({marks})', names)}
+
+
+def _prepare_batch(db, batch, seen, password_length, method, report):
+    existing = _existing(db, [u for u, _ in batch])
+    new = []
+    for username, grade in batch:
+        if grade is None:
+            report.rows.append({'username': username, 'grade': '', 'password': '', 'status': 'invalid grade'})
+        elif username in existing or username in seen:
+            report.rows.append({'username': username, 'grade': grade, 'password': '', 'status': 'exists'})
+        else:
+            seen.add(username)
+            row = {'username': username, 'grade': grade, 'password': generate_password(password_length),
+                   'status': 'created'}
+            report.rows.append(row)
+            new.append(row)
+    hashes = hash_many([r['password'] for r in new], method)
+    return [(r, h) for r, h in zip(new, hashes)]
+
+
+def provision(db, fileobj, password_length, method, batch_size=BATCH_SIZE):
+    """
+    Create users from a CSV; returns a ProvisionReport.
+
+    Hashing happens before the write transaction so the database is not
+    locked while it runs. The inserts then happen in one transaction that
+    is left open for the caller to add its own writes (generation bump,
+    audit entry) and commit; on error it is rolled back.
+    """
+    report = ProvisionReport()
+    seen = set()
+    pending = []
+    batch = []
+    for item in iter_rows(fileobj):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            pending += _prepare_batch(db, batch, seen, password_length, method, report)
+            batch = []
+    if batch:
+        pending += _prepare_batch(db, batch, seen, password_length, method, report)
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i:i + batch_size]
+            # someone may have added one of these names since the check above
+            taken = _existing(db, [r['username'] for r, _ in chunk])
+            rows = []
+            for row, pwhash in chunk:
+                if row['username'] in taken:
+                    row.update(password='', status='exists')
+                else:
+                    rows.append((row['username'], pwhash, row['grade'], 'user'))
+            db.executemany('INSERT INTO users (username, password_hash, grade, is_admin, role) VALUES (?,?,?,0,?)',
+                           rows)
+            report.created += len(rows)
+    except BaseException:
+        db.rollback()
+        raise
+    return report
@@ -0,0 +1,178 @@
+"""
+Pre-rendered content fragments.
+
+Each content row gets a content_renders row, written together with the
+content: the sanitized body with srcset and lazy-loading attributes on its
+images, a plain-text excerpt, and the dashboard card markup. Rows are
+stamped with a version made from sanitizer.VERSION, RENDER_VERSION and the
+sanitize setting. When any of those changes, or an upload gains variants,
+the stamp goes stale and RenderJob re-renders in the background. Views
+render stale rows on the fly (without storing them) until then.
+"""
+
+import logging
+import re
+import threading
+
+from markupsafe import Markup
+
+import image_variants
+import sanitizer
+import search
+
+log = logging.getLogger(__name__)
+
+# bump whenever the output below changes
+RENDER_VERSION = 1
+EXCERPT_CHARS = 200
+BATCH_SIZE = 100
+
+_IMG_RE = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+
+COLUMNS = 'r.version AS render_version, r.body AS render_body, r.excerpt AS render_excerpt, r.card AS render_card'
+JOIN = 'LEFT JOIN content_renders r ON r.content_id = c.id'
+
+
+def version(sanitize=True):
+    return f'{sanitizer.VERSION if sanitize else 0}.{RENDER_VERSION}'
+
+
+def _lazy(tag):
+    tag = tag.group(0)
+    if ' loading=' not in tag:
+        tag = tag[:4] + ' loading="lazy" decoding="async"' + tag[4:]
+    return tag
+
+
+def excerpt(body):
+    text = search.html_text(body)
+    return text[:EXCERPT_CHARS] + ('…' if len(text) > EXCERPT_CHARS else '')
+
+
+def card(content_id, title, summary):
+    return Markup(
+        '<div class="card mb-3 content-item" data-id="{id}"><div class="card-body">'
+        '<h5>{title}</h5><p class="text-muted excerpt">{summary}</p><div class="full-html"></div>'
+        '<button type="button" class="btn btn-sm btn-outline-primary show-full">عرض المحتوى</button>'
+        '</div></div>'
+    ).format(id=content_id, title=title or '', summary=summary)
+
+
+def render_rows(db, rows, sanitize=True):
+    """{content id: (body, excerpt, card)} for contents rows."""
+    htmls = [r['html'] or '' for r in rows]
+    if sanitize:
+        htmls = sanitizer.sanitize_many(htmls)
+    out = {}
+    for row, html in zip(rows, htmls):
+        body = _IMG_RE.sub(_lazy, image_variants.rewrite_srcset(html, db))
+        summary = excerpt(body)
+        out[row['id']] = (body, summary, str(card(row['id'], row['title'], summary)))
+    return out
+
+
+def store(db, rows, sanitize=True):
+    """Render and save fragments for rows, inside the caller's transaction."""
+    stamp = version(sanitize)
+    rendered = render_rows(db, rows, sanitize)
+    db.executemany('''INSERT OR REPLACE INTO content_renders (content_id, version, body, excerpt, card)
+                      VALUES (?,?,?,?,?)''', [(cid, stamp) + parts for cid, parts in rendered.items()])
+    return rendered
+
+
+def fragments(db, rows, sanitize=True):
+    """
+    (body, excerpt, card) per row of a query that selected COLUMNS.
+
+    Stale or missing renders are made on the fly and not stored; returns
+    the fragments and how many were stale.
+    """
+    stamp = version(sanitize)
+    stale = [r for r in rows if r['render_version'] != stamp]
+    fresh = render_rows(db, stale, sanitize) if stale else {}
+    out = []
+    for r in rows:
+        if r['id'] in fresh:
+            out.append(fresh[r['id']])
+        else:
+            out.append((r['render_body'], r['render_excerpt'], r['render_card']))
+    return out, len(stale)
+
+
+def mark_stale(db, upload_filename):
+    # an upload got variants: contents showing it need new srcsets
+    db.execute('''UPDATE content_renders SET version = '' WHERE content_id IN (
+                      SELECT id FROM contents WHERE html LIKE ?)''', (f'%/static/uploads/{upload_filename}%',))
+
+
+class RenderJob:
+    """
+    Background re-render of stale rows, in batches.
+
+    connect() must return a connection usable on the job thread, options(db)
+    returns the sanitize flag, and on_batch(db) runs before each commit.
+    """
+
+    def __init__(self, connect, options, on_batch=None, batch_size=BATCH_SIZE):
+        self.connect = connect
+        self.options = options
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = False
+        self.rendered = 0
+
+    def kick(self):
+        with self._lock:
+            if self._stop:
+                return
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='render-job', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stop:
+                return
+            try:
+                while not self._stop and self.run_batch():
+                    pass
+            except Exception:
+                log.exception('re-render failed')
+
+    def run_batch(self):
+        """Re-render one batch; returns how many rows it did."""
+        db = self.connect()
+        sanitize = self.options(db)
+        # under the write lock, so an edit cannot land between read and store
+        db.execute('BEGIN IMMEDIATE')
+        rows = db.execute('''SELECT c.id, c.title, c.html FROM contents c
+                             LEFT JOIN content_renders r ON r.content_id = c.id
+                             WHERE r.version IS NULL OR r.version != ?
+                             ORDER BY c.id LIMIT ?''', (version(sanitize), self.batch_size)).fetchall()
+        if not rows:
+            db.rollback()
+            return 0
+        try:
+            store(db, rows, sanitize)
+            if self.on_batch:
+                self.on_batch(db)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        self.rendered += len(rows)
+        return len(rows)
+
+    def stop(self):
+        with self._lock:
+            self._stop = True
+            thread = self._thread
+        self._wake.set()
+        if thread and thread.is_alive():
+            thread.join()
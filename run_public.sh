@@ -23,8 +23,8 @@ echo ""
 echo "🚀 Starting Flask application..."
 echo ""
 
-# Start Flask app in background
-python app.py &
+# Start Flask app in background (pre-forked production server)
+flask --app app serve --port 5000 &
 FLASK_PID=$!
 
 # Wait for Flask to start
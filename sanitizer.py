@@ -0,0 +1,114 @@
+"""
+HTML sanitization for content bodies.
+
+One bleach Cleaner is configured per thread and reused, large batches are
+spread over a process pool, and documents already known to be clean (by
+SHA-256 of the text) are passed through without re-parsing.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from bleach.sanitizer import Cleaner
+
+import process_pool
+
+ALLOWED_TAGS = ['p', 'b', 'i', 'u', 'a', 'img', 'ul', 'ol', 'li', 'br', 'strong', 'em',
+                'h1', 'h2', 'h3', 'h4', 'iframe', 'div', 'span']
+ALLOWED_ATTRS = {
+    'a': ['href', 'target', 'rel'],
+    'img': ['src', 'alt', 'style'],
+    'iframe': ['src', 'width', 'height', 'frameborder', 'allow', 'allowfullscreen'],
+    '*': ['style', 'class'],
+}
+# bump whenever the allow-lists change so cached verdicts are dropped
+VERSION = 1
+
+# below this many documents the pool's IPC costs more than it saves
+POOL_THRESHOLD = 64
+KNOWN_CLEAN_MAX = 50000
+
+_local = threading.local()
+_pool = None
+_pool_lock = threading.Lock()
+_known_clean = OrderedDict()
+_known_lock = threading.Lock()
+
+
+def get_cleaner():
+    # Cleaner instances are not safe to share between threads
+    cleaner = getattr(_local, 'cleaner', None)
+    if cleaner is None:
+        cleaner = _local.cleaner = Cleaner(tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS, strip=True)
+    return cleaner
+
+
+def _digest(html):
+    return hashlib.sha256(f'{VERSION}:{html}'.encode('utf-8')).digest()
+
+
+def _is_known_clean(digest):
+    with _known_lock:
+        if digest in _known_clean:
+            _known_clean.move_to_end(digest)
+            return True
+    return False
+
+
+def _remember_clean(digests):
+    with _known_lock:
+        for d in digests:
+            _known_clean[d] = True
+            _known_clean.move_to_end(d)
+        while len(_known_clean) > KNOWN_CLEAN_MAX:
+            _known_clean.popitem(last=False)
+
+
+def _clean(html):
+    return get_cleaner().clean(html)
+
+
+def sanitize(html):
+    html = html or ''
+    digest = _digest(html)
+    if _is_known_clean(digest):
+        return html
+    safe = _clean(html)
+    _remember_clean([_digest(safe)])
+    return safe
+
+
+def sanitize_many(htmls):
+    """Sanitize a list of documents, in a process pool when it is large."""
+    global _pool
+    htmls = [h or '' for h in htmls]
+    out = list(htmls)
+    todo = [i for i, h in enumerate(htmls) if not _is_known_clean(_digest(h))]
+    if len(todo) < POOL_THRESHOLD or (os.cpu_count() or 1) < 2:
+        cleaned = [_clean(htmls[i]) for i in todo]
+    else:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=process_pool.mp_context())
+        cleaned = list(_pool.map(_clean, [htmls[i] for i in todo], chunksize=16))
+    for i, safe in zip(todo, cleaned):
+        out[i] = safe
+    _remember_clean(_digest(s) for s in cleaned)
+    return out
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def stats():
+    with _known_lock:
+        known = len(_known_clean)
+    return {'known_clean': known, 'pool_started': int(_pool is not None)}
@@ -0,0 +1,60 @@
+"""
+Full-text search over contents and usernames (SQLite FTS5).
+
+contents_fts indexes title, the text of the html and categories, and
+users_fts indexes usernames with the trigram tokenizer so any substring of
+three or more characters matches. Both are kept in sync by triggers (see
+migrations.py). Triggers call html_text(), so every connection that writes
+contents must have it registered via register().
+"""
+
+import html
+import re
+
+_TAG_RE = re.compile(r'<[^>]*>')
+_SPACE_RE = re.compile(r'\s+')
+# trigram needs at least three characters to match anything
+MIN_TRIGRAM = 3
+
+
+def html_text(value):
+    if not value:
+        return ''
+    return _SPACE_RE.sub(' ', html.unescape(_TAG_RE.sub(' ', value))).strip()
+
+
+def register(db):
+    db.create_function('html_text', 1, html_text, deterministic=True)
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def match_expression(q):
+    """FTS5 query for free text: every word must match, as a prefix."""
+    terms = [t for t in _SPACE_RE.split(q or '') if t]
+    return ' '.join(_quote(t) + '*' for t in terms)
+
+
+def filter_contents(query, q):
+    """
+    Restrict a dashboard_query contents Query to matches of q; returns the
+    ordering, by rank. A q with no terms leaves the query unfiltered.
+    """
+    expression = match_expression(q)
+    if not expression:
+        return 'c.id DESC'
+    query.join('JOIN contents_fts ON contents_fts.rowid = c.id')
+    query.filter('contents_fts MATCH ?', expression)
+    return 'contents_fts.rank, c.id DESC'
+
+
+def filter_users(query, q):
+    """Same for the users Query; short queries fall back to a LIKE scan."""
+    if len(q.strip()) < MIN_TRIGRAM:
+        query.filter('username LIKE ?', f'%{q.strip()}%')
+        return 'id'
+    query.join('JOIN users_fts ON users_fts.rowid = users.id')
+    query.filter('users_fts MATCH ?', _quote(q.strip()))
+    return 'users_fts.rank, users.id'
@@ -0,0 +1,264 @@
+"""
+Pre-forking, multi-threaded WSGI server for production.
+
+The master process binds the socket, preloads the app (migrations, default
+admin, compiled templates) and forks workers that share the socket and the
+loaded code. Each worker runs werkzeug's HTTP server with a fixed pool of
+request threads; it only accepts a connection when a thread is free, so
+busy workers leave new connections to idle ones. Workers open their own
+SQLite connections (the master closes its own before forking) and only the
+first one resumes background jobs at startup.
+
+Signals to the master:
+    SIGHUP          reload: re-execute the master (loading new code) on the
+                    same socket, start new workers, then retire the old ones
+                    once they finish their requests
+    SIGTERM/SIGINT  stop after in-flight requests, at most graceful_timeout
+Workers that die are replaced. Without fork() (Windows) it serves from one
+process.
+"""
+
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+log = logging.getLogger(__name__)
+
+# SQLite takes one writer at a time, so past a few processes more workers
+# only add lock contention
+MAX_WORKERS = 8
+# requests mostly wait on SQLite or the client, which releases the GIL
+THREADS = 4
+GRACEFUL_TIMEOUT = 30
+KEEPALIVE_TIMEOUT = 5
+LISTEN_FD_ENV = 'CMS_LISTEN_FD'
+OLD_WORKERS_ENV = 'CMS_OLD_WORKERS'
+
+_MASTER_SIGNALS = {signal.SIGHUP, signal.SIGTERM, signal.SIGINT} if hasattr(signal, 'SIGHUP') else set()
+
+# set in a worker once it stops taking new requests; readiness checks read it
+draining = threading.Event()
+
+
+def default_workers():
+    return max(1, min(os.cpu_count() or 1, MAX_WORKERS))
+
+
+class _Handler(WSGIRequestHandler):
+    # idle keep-alive connections are dropped so they do not hold a thread
+    timeout = KEEPALIVE_TIMEOUT
+    access_log = False
+
+    def log_request(self, code='-', size='-'):
+        if self.access_log:
+            super().log_request(code, size)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """werkzeug's server, handling connections on a fixed pool of threads."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=THREADS, fd=None):
+        super().__init__(host, port, app, handler=_Handler, fd=fd)
+        # several processes wait on one socket; a blocking accept() would
+        # hang whichever lost the race
+        self.socket.setblocking(False)
+        self._slots = threading.BoundedSemaphore(threads)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        self._executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        # also called by BaseWSGIServer.__init__, before the pool exists
+        executor = getattr(self, '_executor', None)
+        if executor:
+            executor.shutdown(wait=True)
+
+
+def _listen(host, port):
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd:
+        # inherited from the master this one replaced
+        sock = socket.socket(fileno=int(fd))
+    else:
+        sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(PooledWSGIServer.request_queue_size)
+    return sock
+
+
+def preload(app_module):
+    """Everything workers can share: schema, default admin, compiled templates."""
+    app_module.bootstrap(start_jobs=False)
+    env = app_module.app.jinja_env
+    for name in env.list_templates():
+        env.get_template(name)
+    # SQLite connections must not cross fork(); workers open their own
+    app_module.db_pool.close_all()
+
+
+def _serve_worker(app_module, sock, threads, index):
+    # the master turns Ctrl-C and SIGHUP into SIGTERM for its workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, _MASTER_SIGNALS)
+    host, port = sock.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app_module.app, threads, fd=sock.fileno())
+
+    def drain(signum, frame):
+        draining.set()
+        # shutdown() waits for serve_forever, which runs on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, drain)
+    if index == 0:
+        app_module.start_background_jobs()
+    server.serve_forever()
+    app_module.shutdown()
+
+
+class Master:
+    def __init__(self, app_module, sock, workers, threads, graceful_timeout=GRACEFUL_TIMEOUT):
+        self.app_module = app_module
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.children = {}
+        self._started = {}
+        self._signals = []
+
+    def spawn(self, index):
+        # held until the child has replaced the master's handlers, which
+        # would otherwise swallow a SIGTERM sent right after the fork
+        signal.pthread_sigmask(signal.SIG_BLOCK, _MASTER_SIGNALS)
+        pid = os.fork()
+        if pid:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, _MASTER_SIGNALS)
+            self.children[pid] = index
+            self._started[index] = time.monotonic()
+            return
+        code = 0
+        try:
+            _serve_worker(self.app_module, self.sock, self.threads, index)
+        except BaseException:
+            log.exception('worker %d failed', index)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def run(self):
+        for signum in _MASTER_SIGNALS:
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        previous = [int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid]
+        for index in range(self.workers):
+            self.spawn(index)
+        log.info('serving on %s:%s with %d workers x %d threads', *self.sock.getsockname()[:2],
+                 self.workers, self.threads)
+        # the workers of the master we replaced are our children too (same
+        # pid across exec); they finish their requests and get reaped below
+        for pid in previous:
+            self._kill(pid, signal.SIGTERM)
+        while True:
+            self.reap()
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reload()
+                else:
+                    self.stop()
+                    return
+            time.sleep(0.5)
+
+    def reap(self, respawn=True):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            index = self.children.pop(pid, None)
+            if index is None or not respawn:
+                continue
+            log.warning('worker %d (pid %d) exited with status %d, restarting', index, pid, status)
+            if time.monotonic() - self._started.get(index, 0) < 1:
+                # crashing at startup: do not fork in a tight loop
+                time.sleep(1)
+            self.spawn(index)
+
+    def reload(self):
+        name = self.app_module.__name__
+        # a broken deploy must not take down the running workers
+        folder = os.path.dirname(os.path.abspath(self.app_module.__file__))
+        check = subprocess.run([sys.executable, '-c', f'import sys; sys.path.insert(0, {folder!r}); import {name}'],
+                               capture_output=True, text=True)
+        if check.returncode:
+            log.error('reload aborted, %s does not import:\n%s', name, check.stderr)
+            return
+        log.info('reloading')
+        os.environ[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in self.children)
+        os.environ[LISTEN_FD_ENV] = str(self.sock.fileno())
+        # keep sessions valid across the reload when no secret is configured
+        os.environ.setdefault('FLASK_SECRET', self.app_module.app.secret_key)
+        self.sock.set_inheritable(True)
+        argv = getattr(sys, 'orig_argv', None) or [sys.executable] + sys.argv
+        os.execv(sys.executable, argv)
+
+    def stop(self):
+        log.info('stopping %d workers', len(self.children))
+        for pid in list(self.children):
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            self.reap(respawn=False)
+            time.sleep(0.1)
+        for pid in list(self.children):
+            log.warning('worker pid %d did not stop in time, killing it', pid)
+            self._kill(pid, signal.SIGKILL)
+        self.reap(respawn=False)
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            self.children.pop(pid, None)
+
+
+def run(app_module, host='0.0.0.0', port=5000, workers=None, threads=THREADS, access_log=False,
+        graceful_timeout=GRACEFUL_TIMEOUT):
+    """Serve app_module.app until stopped; see the module docstring."""
+    logging.basicConfig(level=logging.INFO, format='[%(process)d] %(levelname)s %(message)s')
+    _Handler.access_log = access_log
+    if not hasattr(os, 'fork'):
+        app_module.bootstrap()
+        log.info('serving on %s:%s with 1 process x %d threads', host, port, threads)
+        PooledWSGIServer(host, port, app_module.app, threads).serve_forever()
+        app_module.shutdown()
+        return
+    sock = _listen(host, port)
+    preload(app_module)
+    Master(app_module, sock, workers or default_workers(), threads, graceful_timeout).run()
@@ -0,0 +1,94 @@
+"""
+In-memory copy of the settings table.
+
+The whole table is loaded once and reads are dict lookups. Writes go
+through set_many(), which bumps the 'settings' row in generations in the
+same transaction. Before serving a read, the store checks PRAGMA
+data_version on the caller's connection. That value only changes when
+another connection has committed something, and only then is the version
+row read and, if it moved, the table reloaded.
+"""
+
+import threading
+
+
+def _bool(value):
+    return str(value).strip().lower() not in ('0', 'false', 'off', 'no', '')
+
+
+# name -> (parser, default)
+SETTINGS = {
+    'password_length': (int, 8),
+    'sanitize_html': (_bool, True),
+    'audit_retention_days': (int, 90),
+    'password_hash_method': (str, 'pbkdf2:sha256'),
+    'password_hash_iterations': (int, 600000),
+}
+
+
+def _parse(key, value, default):
+    parser, fallback = SETTINGS.get(key, (str, None))
+    if default is None:
+        default = fallback
+    if value is None:
+        return default
+    try:
+        return parser(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _serialize(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return str(value)
+
+
+class SettingsStore:
+    def __init__(self):
+        self._values = None
+        self._version = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reloads = 0
+
+    def _version_of(self, db):
+        row = db.execute("SELECT value FROM generations WHERE name='settings'").fetchone()
+        return row[0] if row else 0
+
+    def _load(self, db):
+        version = self._version_of(db)
+        values = {r[0]: r[1] for r in db.execute('SELECT key, value FROM settings')}
+        with self._lock:
+            self._values, self._version = values, version
+            self.reloads += 1
+
+    def _refresh(self, db):
+        data_version = db.execute('PRAGMA data_version').fetchone()[0]
+        seen = getattr(self._local, 'seen', None)
+        if self._values is not None and seen == (id(db), data_version):
+            return
+        self._local.seen = (id(db), data_version)
+        if self._values is None or self._version_of(db) != self._version:
+            self._load(db)
+
+    def get(self, db, key, default=None):
+        """Typed value of a setting (see SETTINGS); default overrides the registered one."""
+        self._refresh(db)
+        return _parse(key, self._values.get(key), default)
+
+    def all(self, db):
+        self._refresh(db)
+        return {key: _parse(key, self._values.get(key), None) for key in set(SETTINGS) | set(self._values)}
+
+    def set_many(self, db, values):
+        """Write settings and bump the version; commits."""
+        db.executemany('REPLACE INTO settings (key, value) VALUES (?,?)',
+                       [(k, _serialize(v)) for k, v in values.items()])
+        db.execute("UPDATE generations SET value = value + 1 WHERE name='settings'")
+        db.commit()
+        self._load(db)
+
+    def clear(self):
+        with self._lock:
+            self._values = self._version = None
@@ -86,9 +86,9 @@ def start_flask():
         return None
     
     try:
-        # Start Flask
+        # Start Flask (pre-forked production server, not the debug server)
         process = subprocess.Popen(
-            [sys.executable, 'app.py'],
+            [sys.executable, '-m', 'flask', '--app', 'app', 'serve', '--port', '5000'],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True
@@ -0,0 +1,80 @@
+// Infinite scroll for the user dashboard: pages come from /api/contents as
+// summaries, and the full HTML of an item is fetched when it is opened.
+(function () {
+  const feed = document.getElementById('feed');
+  const sentinel = document.getElementById('feed-sentinel');
+  if (!feed || !sentinel) return;
+  const baseUrl = feed.dataset.url;
+  let next = feed.dataset.next || null;
+  // a search keeps applying while scrolling and filtering
+  let filters = feed.dataset.q ? {q: feed.dataset.q} : {};
+  let loading = false;
+  let seq = 0;
+
+  function url(cursor) {
+    const params = new URLSearchParams(filters);
+    if (cursor) params.set('cursor', cursor);
+    return baseUrl + '?' + params.toString();
+  }
+
+  function load(reset) {
+    // a filter change supersedes whatever page is still loading
+    if (!reset && (loading || !next)) return;
+    const mine = ++seq;
+    loading = true;
+    sentinel.textContent = 'جار التحميل...';
+    fetch(url(reset ? null : next), {credentials: 'same-origin'})
+      .then(function (r) { return r.json(); })
+      .then(function (data) {
+        if (mine !== seq) return;
+        if (reset) feed.innerHTML = '';
+        // cards are pre-rendered on the server, with the title and excerpt escaped
+        data.items.forEach(function (item) { feed.insertAdjacentHTML('beforeend', item.card); });
+        next = data.next_cursor;
+        sentinel.textContent = next ? '' : (feed.children.length ? '' : 'لا يوجد محتوى');
+      })
+      .catch(function () { sentinel.textContent = 'تعذر التحميل'; })
+      .finally(function () { if (mine === seq) loading = false; });
+  }
+
+  const root = document.getElementById('contents');
+  new IntersectionObserver(function (entries) {
+    if (entries.some(function (e) { return e.isIntersecting; })) load(false);
+  }, {root: root, rootMargin: '400px'}).observe(sentinel);
+
+  feed.addEventListener('click', function (e) {
+    const button = e.target.closest('.show-full');
+    if (!button) return;
+    const item = button.closest('.content-item');
+    const target = item.querySelector('.full-html');
+    if (target.dataset.loaded) {
+      target.hidden = !target.hidden;
+      return;
+    }
+    button.disabled = true;
+    fetch(baseUrl + '/' + item.dataset.id, {credentials: 'same-origin'})
+      .then(function (r) { return r.json(); })
+      .then(function (data) {
+        // already sanitized on the server when it was saved
+        target.innerHTML = data.html || '';
+        target.dataset.loaded = '1';
+        item.querySelector('.excerpt').hidden = true;
+      })
+      .finally(function () { button.disabled = false; });
+  });
+
+  document.querySelectorAll('.grade-filter').forEach(function (a) {
+    a.addEventListener('click', function (e) {
+      e.preventDefault();
+      filters.grade = a.dataset.grade;
+      load(true);
+    });
+  });
+  const category = document.getElementById('categoryFilter');
+  if (category) {
+    category.addEventListener('change', function () {
+      if (category.value) filters.category = category.value; else delete filters.category;
+      load(true);
+    });
+  }
+})();
@@ -0,0 +1,70 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audit  # noqa: E402
+
+SCHEMA = '''CREATE TABLE audit_logs (id INTEGER PRIMARY KEY, ts TEXT, user_id INTEGER, verb TEXT,
+                                     target_type TEXT, target_id INTEGER, action TEXT)'''
+
+
+class AuditWriterTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'audit.db')
+        self.connections = []
+        with self.connect() as db:
+            db.execute(SCHEMA)
+        # long enough that waiting it out would fail the latency checks
+        self.writer = audit.AuditWriter(self.connect, flush_interval=5.0)
+        self.addCleanup(self.close)
+
+    def connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        self.connections.append(db)
+        return db
+
+    def close(self):
+        self.writer.close()
+        for db in self.connections:
+            db.close()
+
+    def count(self):
+        return self.connect().execute('SELECT COUNT(*) FROM audit_logs').fetchone()[0]
+
+    def timed_flush(self):
+        start = time.monotonic()
+        self.writer.flush()
+        return time.monotonic() - start
+
+    def test_flush_writes_pending_events_without_waiting_for_the_interval(self):
+        self.writer.log(1, 'imported')
+        self.writer.log(1, 'added', 'content', 7)
+        self.assertLess(self.timed_flush(), 0.5)
+        self.assertEqual(self.count(), 2)
+        self.assertEqual(self.writer.batches, 1)
+
+    def test_flush_after_everything_is_written(self):
+        self.writer.log(1, 'imported')
+        self.writer.flush()
+        self.assertLess(self.timed_flush(), 0.5)
+        self.assertEqual(self.count(), 1)
+
+    def test_flush_before_any_event(self):
+        self.assertLess(self.timed_flush(), 0.5)
+
+    def test_flush_after_close(self):
+        self.writer.log(1, 'imported')
+        self.writer.close()
+        self.assertLess(self.timed_flush(), 0.5)
+        self.assertEqual(self.count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
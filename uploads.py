@@ -0,0 +1,90 @@
+"""
+Image upload storage.
+
+Uploads are streamed to a temp file in fixed-size chunks while being hashed,
+so the size cap is enforced as bytes arrive and the file is never held in
+memory. Files are content-addressed: the uploads table maps the full SHA-256
+to the stored file, and a repeat upload reuses it without touching the disk.
+"""
+
+import hashlib
+import os
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+MAX_SIZE = 4 * 1024 * 1024
+
+# magic number -> (mime type, extension)
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png', 'png'),
+    (b'\xff\xd8\xff', 'image/jpeg', 'jpg'),
+    (b'GIF87a', 'image/gif', 'gif'),
+    (b'GIF89a', 'image/gif', 'gif'),
+]
+
+
+def sniff_image(head):
+    """(mime, ext) for a supported image header, or None."""
+    for magic, mime, ext in SIGNATURES:
+        if head.startswith(magic):
+            return mime, ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp', 'webp'
+    return None
+
+
+class UploadRejected(Exception):
+    pass
+
+
+def _spool(stream, folder, max_size):
+    """Copy stream into a temp file in folder; returns (path, sha256, size, head)."""
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    fd, tmp_path = tempfile.mkstemp(prefix='.upload-', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadRejected('file too large')
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size, head
+
+
+def store(db, file, folder, max_size=MAX_SIZE):
+    """
+    Save an uploaded image and return its uploads row.
+
+    Raises UploadRejected for oversized or non-image files.
+    """
+    os.makedirs(folder, exist_ok=True)
+    tmp_path, sha256, size, head = _spool(file.stream, folder, max_size)
+    try:
+        kind = sniff_image(head)
+        if kind is None:
+            raise UploadRejected('not a supported image')
+        row = db.execute('SELECT * FROM uploads WHERE sha256=?', (sha256,)).fetchone()
+        if row and os.path.exists(os.path.join(folder, row['filename'])):
+            return row
+        mime, ext = kind
+        filename = f'{sha256[:16]}.{ext}'
+        os.replace(tmp_path, os.path.join(folder, filename))
+        tmp_path = None
+        db.execute('INSERT OR REPLACE INTO uploads (sha256, filename, size, mime) VALUES (?,?,?,?)',
+                   (sha256, filename, size, mime))
+        db.commit()
+        return db.execute('SELECT * FROM uploads WHERE sha256=?', (sha256,)).fetchone()
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)